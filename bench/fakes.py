@@ -0,0 +1,132 @@
+"""Локальные заглушки Bot API и Supabase PostgREST для нагрузочных прогонов без сети."""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+import httpx
+from telegram.request import BaseRequest
+
+SERIES_SIZES = {1: 42, 2: 27, 3: 25}
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "AsanaBench", "username": "asana_bench_bot"}
+
+
+def make_asanas():
+    rows, ids = [], itertools.count(1)
+    for series, size in SERIES_SIZES.items():
+        for n in range(1, size + 1):
+            aid = next(ids)
+            rows.append({
+                "id": aid, "series": series, "order_num": n,
+                "name": f"Asana {series}-{n}", "transcription": f"асана {series}-{n}",
+                "meaning": "", "image_url": f"https://bench.local/asanas/{aid}.png",
+            })
+    return rows
+
+
+class FakeBotApi(BaseRequest):
+    """Отвечает на методы Bot API как Telegram и запоминает последнее сообщение бота в каждом чате."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.calls_by_chat = Counter()
+        self.last_message = {}  # chat_id -> dict сообщения
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if "chat_id" in params:
+            self.calls_by_chat[int(params["chat_id"])] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self._result(endpoint, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "sendPhoto", "sendVideo"):
+            return self._message(params, new=True)
+        if endpoint in ("editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"):
+            return self._message(params, new=False)
+        return True
+
+    def _message(self, params, new: bool):
+        chat_id = int(params["chat_id"])
+        prev = self.last_message.get(chat_id, {})
+        msg = {
+            "message_id": next(self._message_ids) if new else params.get("message_id", prev.get("message_id", 0)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        media = params.get("media")
+        if isinstance(media, str):
+            media = json.loads(media)
+        if "photo" in params or media:
+            msg["photo"] = [{"file_id": f"photo-{next(self._file_ids)}", "file_unique_id": "u", "width": 1, "height": 1}]
+            msg["caption"] = (media or {}).get("caption") or params.get("caption") or ""
+        elif "video" in params:
+            msg["video"] = {"file_id": f"video-{next(self._file_ids)}", "file_unique_id": "u",
+                            "width": 1, "height": 1, "duration": 1}
+            msg["caption"] = params.get("caption") or ""
+        elif "text" in params:
+            msg["text"] = params["text"]
+        else:
+            # editMessageCaption/ReplyMarkup: остальное берём из прошлого состояния сообщения
+            msg.update({k: v for k, v in prev.items() if k in ("photo", "video", "text", "caption")})
+            if "caption" in params:
+                msg["caption"] = params["caption"]
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if markup:
+            msg["reply_markup"] = markup
+        self.last_message[chat_id] = msg
+        return msg
+
+
+class FakeSupabase:
+    """Ответы PostgREST для таблиц asanas, users и interactions через httpx.MockTransport."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.rows = make_asanas()
+        self.calls = Counter()
+        self.inserted = Counter()
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        table = request.url.path.rsplit("/", 1)[-1]
+        self.calls[f"{request.method} {table}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.method == "GET" and table == "asanas":
+            series = request.url.params.get("series")
+            rows = [a for a in self.rows if not series or f"eq.{a['series']}" == series]
+            return httpx.Response(200, json=rows)
+        if request.method == "POST":
+            body = json.loads(request.content)
+            self.inserted[table] += len(body) if isinstance(body, list) else 1
+            return httpx.Response(201)
+        if request.method == "PATCH":
+            return httpx.Response(200, json=[])
+        return httpx.Response(404)
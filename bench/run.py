@@ -0,0 +1,236 @@
+"""Нагрузочный прогон бота целиком офлайн: заглушки Bot API и Supabase, тысячи пользователей.
+
+    python -m bench.run --users 2000 --concurrency 200
+    python -m bench.run --flow test --users 500 --bot-latency 0.05 --json bench_output.json
+
+Каждый пользователь проходит сценарий обучения (learn -> номера -> nav...) и/или теста
+(pretest -> start_test -> answer...), нажимая кнопки из последнего сообщения бота.
+
+Апдейты идут через app.update_queue запущенного приложения, как от вебхука, поэтому
+задержка включает ожидание в ChatOrderedProcessor и лимит CONCURRENT_UPDATES.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# main читает настройки из окружения при импорте, поэтому готовим его заранее
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="asana-bench-"))
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("SUPABASE_URL", "https://bench.local")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+from bench.fakes import SERIES_SIZES, FakeBotApi, FakeSupabase  # noqa: E402
+from utils.ratelimit import SendScheduler  # noqa: E402
+
+LAST_GROUP = 1000
+
+
+class SimUser:
+    _update_ids = itertools.count(1)
+
+    def __init__(self, app, router, bot_api, chat_id, rng, latencies, inflight):
+        self.app = app
+        self.inflight = inflight  # update_id -> Future, закрывается после всех обработчиков
+        self.router = router
+        self.bot_api = bot_api
+        self.chat_id = chat_id
+        self.rng = rng
+        self.latencies = latencies
+        self.user = {"id": chat_id, "is_bot": False, "first_name": f"u{chat_id}"}
+
+    async def _process(self, kind, payload):
+        update = Update.de_json({"update_id": next(self._update_ids), **payload}, self.app.bot)
+        done = self.inflight[update.update_id] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self.app.update_queue.put(update)
+        await done
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    async def command(self, text):
+        await self._process(text, {"message": {
+            "message_id": 1, "date": int(time.time()), "from": self.user, "text": text,
+            "chat": {"id": self.chat_id, "type": "private"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        }})
+
+    async def text(self, text):
+        await self._process("text", {"message": {
+            "message_id": 1, "date": int(time.time()), "from": self.user, "text": text,
+            "chat": {"id": self.chat_id, "type": "private"},
+        }})
+
+    def buttons(self):
+        """[(action, args, callback_data)] кнопок последнего сообщения."""
+        markup = self.bot_api.last_message.get(self.chat_id, {}).get("reply_markup") or {}
+        datas = [b.get("callback_data") for row in markup.get("inline_keyboard", []) for b in row if b.get("callback_data")]
+        return [(*self.router.decode(d), d) for d in datas]
+
+    def answers(self):
+        return [(args, data) for action, args, data in self.buttons() if action == "answer"]
+
+    async def tap(self, action, *args):
+        await self.tap_data(action, self.router.encode(action, *args))
+
+    async def tap_data(self, kind, data):
+        message = self.bot_api.last_message.get(self.chat_id) or {
+            "message_id": 1, "date": int(time.time()), "chat": {"id": self.chat_id, "type": "private"}, "text": "",
+        }
+        await self._process(kind, {"callback_query": {
+            "id": str(next(self._update_ids)), "from": self.user, "chat_instance": str(self.chat_id),
+            "data": data, "message": message,
+        }})
+
+    async def learn_flow(self, steps: int = 10):
+        series = self.rng.choice(list(SERIES_SIZES))
+        await self.command("/start")
+        await self.tap("menu_learn")
+        await self.tap("select_series", series)
+        await self.tap("learn", series)
+        first = self.rng.randint(1, SERIES_SIZES[series] - steps)
+        await self.text(str(first))
+        await self.text(str(first + steps - 1))
+        for _ in range(steps):
+            await self.tap("nav", 1)
+        await self.tap("to_start")
+
+    async def test_flow(self, error_rate: float = 0.2):
+        series = self.rng.choice([1, 2, 3, None])
+        await self.command("/start")
+        await self.tap("menu_test")
+        await self.tap("pretest", series)
+        await self.tap("start_test", series)
+        for _ in range(30):
+            answers = self.answers()
+            if not answers:
+                break
+            right = next(data for (correct, chosen), data in answers if correct == chosen)
+            if self.rng.random() < error_rate:
+                wrong = [data for _, data in answers if data != right]
+                await self.tap_data("answer", self.rng.choice(wrong))
+            await self.tap_data("answer", right)
+        if any(action == "growth" for action, _, _ in self.buttons()):
+            await self.tap("growth")
+            for _ in range(30):
+                answers = self.answers()
+                if not answers:
+                    break
+                await self.tap_data("answer", next(data for (correct, chosen), data in answers if correct == chosen))
+        await self.tap("to_start")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(args):
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    bot_api = FakeBotApi(latency=args.bot_latency)
+    supabase = FakeSupabase(latency=args.db_latency)
+    main.supabase.transport = supabase.transport()
+    if not args.throttle:
+        main.send_scheduler = SendScheduler(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+
+    app = main.build_app(token="123456:BENCH", request=bot_api)
+    inflight = {}
+
+    async def processed(update, context):
+        inflight.pop(update.update_id).set_result(None)
+
+    # Последняя группа срабатывает, когда обработчики бота для апдейта уже отработали
+    app.add_handler(TypeHandler(Update, processed), group=LAST_GROUP)
+    await app.initialize()
+    await main.post_init(app)
+    await app.start()
+
+    rng = random.Random(args.seed)
+    latencies = defaultdict(list)
+    sem = asyncio.Semaphore(args.concurrency)
+    flows = 0
+
+    async def one(i):
+        nonlocal flows
+        user = SimUser(app, main.router, bot_api, 100000 + i, random.Random(rng.random()), latencies, inflight)
+        async with sem:
+            kinds = ["learn", "test"] if args.flow == "mixed" else [args.flow]
+            for kind in kinds:
+                await (user.learn_flow() if kind == "learn" else user.test_flow())
+                flows += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await main.post_shutdown(app)
+    await app.shutdown()
+
+    all_lat = [x for values in latencies.values() for x in values]
+    bot_calls = sum(bot_api.calls.values())
+    db_calls = sum(supabase.calls.values())
+    report = {
+        "users": args.users,
+        "flows": flows,
+        "updates": len(all_lat),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(all_lat) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            kind: {p: round(percentile(values, int(p[1:])) * 1000, 3) for p in ("p50", "p95", "p99")} | {"n": len(values)}
+            for kind, values in sorted(latencies.items()) + [("ALL", all_lat)]
+        },
+        "bot_calls_per_flow": round(bot_calls / flows, 2) if flows else 0,
+        "bot_calls": dict(bot_api.calls.most_common()),
+        "supabase_calls_per_flow": round(db_calls / flows, 3) if flows else 0,
+        "supabase_calls": dict(supabase.calls),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    return report
+
+
+def print_report(r):
+    print(f"users={r['users']} flows={r['flows']} updates={r['updates']} "
+          f"elapsed={r['elapsed_s']}s throughput={r['updates_per_s']} upd/s peak_rss={r['peak_rss_mb']}MB")
+    print(f"{'handler':<16}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, lat in r["latency_ms"].items():
+        print(f"{kind:<16}{lat['n']:>8}{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}")
+    print(f"Bot API calls per flow: {r['bot_calls_per_flow']}  {r['bot_calls']}")
+    print(f"Supabase calls per flow: {r['supabase_calls_per_flow']}  {r['supabase_calls']}")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument("--flow", choices=["learn", "test", "mixed"], default="mixed")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="задержка заглушки Bot API, с")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="задержка заглушки Supabase, с")
+    parser.add_argument("--throttle", action="store_true", help="оставить реальные лимиты SendScheduler")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда сохранить отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
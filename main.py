@@ -1,13 +1,36 @@
 import os
+import asyncio
+import functools
 import logging
 import random
-import httpx
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultCachedPhoto, InlineQueryResultPhoto
+)
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler,
+    Application, CommandHandler, InlineQueryHandler,
     MessageHandler, ConversationHandler, ContextTypes, filters
 )
+from utils.analytics import AnalyticsWriter
+from utils.broadcast import Broadcast
+from utils.callbacks import CallbackRouter, opt_int
+from utils.catalog import AsanaCatalog
+from utils.listing import SeriesListing
+from utils.media import MediaCache
+from utils.metrics import metrics
+from utils.quiz import QuizBuilder
+from utils.ratelimit import BACKGROUND, SendScheduler
+from utils.search import SearchIndex
+from utils.render import show_photo, show_text
+from utils.server import ChatOrderedProcessor, HttpServer, json_response, metrics_endpoint, require_token, serve_webhook
+from utils.sharding import ShardRouter, serve_router
+from utils.srs import SrsEngine
+from utils.stats import StatsEngine
+from utils.sessions import SessionStore, SqliteSessionStore, evict_loop, open_db
+from utils.supabase import Supabase
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
 load_dotenv()
@@ -21,8 +44,45 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_PATH = "/webhook"
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+# Без WEBHOOK_SECRET генерируем новый при каждом старте: вебхук всё равно переустанавливается
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# /metrics и /debug/slow открыты только с Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or WEBHOOK_SECRET
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+ROLE = os.getenv("ROLE", "bot")  # bot | router | worker, см. utils/sharding.py
+SHARD_NODES = [u.strip().rstrip("/") for u in os.getenv("SHARD_NODES", "").split(",") if u.strip()]
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # доля апдейтов под cProfile
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))  # 1 = строго последовательно
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", "3600"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1") == "1"
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "10"))
+DATA_DIR = os.getenv("DATA_DIR", "data")
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "5"))
+ANALYTICS_MAX_BATCH = int(os.getenv("ANALYTICS_MAX_BATCH", "200"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")  # sqlite | memory
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "5000"))  # лимит сессий в памяти на тип
+MEDIA_WARMUP_CHAT_ID = os.getenv("MEDIA_WARMUP_CHAT_ID")
+QUIZ_SEED = int(os.getenv("QUIZ_SEED")) if os.getenv("QUIZ_SEED") else None  # воспроизводимые тесты для нагрузки
+QUIZ_HARD = os.getenv("QUIZ_HARD", "0") == "1"  # варианты из похожих асан
+# Лимит Telegram общий на бота, поэтому воркеры делят его поровну. Воркерам нужен SHARD_COUNT
+# (или тот же SHARD_NODES, что у роутера), иначе каждый возьмёт себе весь лимит
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or len(SHARD_NODES) or 1)
+BOT_GLOBAL_RATE = float(os.getenv("BOT_GLOBAL_RATE", str(30 / SHARD_COUNT)))  # сообщений в секунду
+BOT_CHAT_RATE = float(os.getenv("BOT_CHAT_RATE", "1"))  # сообщений в секунду на личный чат
+BOT_CHAT_BURST = float(os.getenv("BOT_CHAT_BURST", "5"))
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "asanas.snapshot.json")  # запекается в образ
+DAILY_REMINDER_HOUR = int(os.getenv("DAILY_REMINDER_HOUR")) if os.getenv("DAILY_REMINDER_HOUR") else None  # UTC; при шардах только на одном узле
+BROADCAST_ACTIVE_DAYS = int(os.getenv("BROADCAST_ACTIVE_DAYS")) if os.getenv("BROADCAST_ACTIVE_DAYS") else None  # None = всем
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
 
 SERIES_LIMITS = {1: 42, 2: 27, 3: 25}
+FINISH_VIDEO = "https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Other/IMG_4867.MP4"
+WISH_IMAGES = [f"https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Wishes/{i}.png" for i in range(1, 12)]
 SERIES_IMAGES = {
     1: "https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Other/Primary.png",
     2: "https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Other/Intermediate.png",
@@ -30,65 +90,88 @@ SERIES_IMAGES = {
     'mix': "https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Other/Primary.png"
 }
 
-user_data = {}
-test_data = {}
 ASK_START, ASK_END = range(2)
 
 # --- БЛОК РАБОТЫ С БАЗОЙ ---
+supabase = Supabase(
+    SUPABASE_URL, SUPABASE_KEY,
+    http2=SUPABASE_HTTP2,
+    max_connections=SUPABASE_MAX_CONNECTIONS,
+    connect_timeout=SUPABASE_CONNECT_TIMEOUT,
+    read_timeout=SUPABASE_READ_TIMEOUT,
+)
+
 async def fetch_asanas(series: int = None):
-    url = f"{SUPABASE_URL}/rest/v1/asanas"
-    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
     params = {"order": "order_num.asc"}
     if series: params["series"] = f"eq.{series}"
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, params=params)
-        return r.json() if r.status_code == 200 else []
-
-async def get_asana_by_id(aid: int):
-    url = f"{SUPABASE_URL}/rest/v1/asanas"
-    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-    params = {"id": f"eq.{aid}"}
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers, params=params)
-        data = r.json()
-        return data[0] if data else None
-
-async def upsert_user(chat_id: int):
-    url = f"{SUPABASE_URL}/rest/v1/users"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    # Try to update first (if user exists)
-    update_url = f"{url}?chat_id=eq.{chat_id}"
-    update_data = {"latest_interaction": "now()"}
-    async with httpx.AsyncClient() as client:
-        r = await client.patch(update_url, headers=headers, json=update_data)
-        if r.status_code == 200 and r.json():  # Updated successfully
-            return chat_id
-        else:
-            # Insert new user
-            data = {"chat_id": chat_id, "latest_interaction": "now()"}
-            r2 = await client.post(url, headers=headers, json=data)
-            if r2.status_code == 201:
-                return chat_id
-            elif r2.status_code == 409:  # Conflict, user exists
-                return chat_id  # Assume it exists
-    return None
-
-async def log_interaction(user_id: int, interaction_type: str, num_asanas: int):
-    print(f"Logging interaction: user_id={user_id}, type={interaction_type}, num_asanas={num_asanas}")
-    url = f"{SUPABASE_URL}/rest/v1/interactions"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {"user_id": user_id, "type": interaction_type, "number_of_asanas": num_asanas}
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, headers=headers, json=data)
-        print(f"Log interaction response: {r.status_code}")
+    return await supabase.select("asanas", params)
+
+# Пользователи и interactions пишутся пачками в фоне, а не на пути ответа пользователю
+analytics = AnalyticsWriter(
+    supabase, os.path.join(DATA_DIR, "analytics.spool"),
+    flush_interval=ANALYTICS_FLUSH_INTERVAL,
+    max_batch=ANALYTICS_MAX_BATCH,
+)
+
+# Все асаны (~94 строки) держим в памяти, обработчики в Supabase за ними не ходят
+catalog = AsanaCatalog(fetch_asanas, ttl=CATALOG_TTL, snapshot_path=os.path.join(DATA_DIR, "asanas.snapshot.json"))
+quiz = QuizBuilder(catalog, seed=QUIZ_SEED, hard=QUIZ_HARD)
+
+# Сессии хранят только id асан: {'ids': [...], 'idx'} и {'series', 'questions': [[id, вариант x3], ...], 'index', 'errors', 'score'}
+if SESSION_BACKEND == "sqlite":
+    sessions_db = open_db(os.path.join(DATA_DIR, "sessions.db"))
+    learn_sessions = SqliteSessionStore('learn', sessions_db, ttl=SESSION_TTL, max_sessions=SESSION_MAX)
+    test_sessions = SqliteSessionStore('test', sessions_db, ttl=SESSION_TTL, max_sessions=SESSION_MAX)
+else:
+    sessions_db = None
+    learn_sessions = SessionStore('learn', ttl=SESSION_TTL, max_sessions=SESSION_MAX)
+    test_sessions = SessionStore('test', ttl=SESSION_TTL, max_sessions=SESSION_MAX)
+# Память по каждой асане для интервального повторения; ответы в тестах тоже идут сюда
+srs = SrsEngine(catalog, sessions_db, max_users=SESSION_MAX)
+# Каждый ответ в тесте: сырые события пачками в SQLite, агрегаты для /stats и /top в памяти
+# При ROLE=worker агрегаты и рейтинг свои у каждого шарда
+stats = StatsEngine(catalog, sessions_db)
+background_tasks = []
+
+# Через планировщик проходит каждый запрос к Bot API, включая reply_* из обработчиков
+send_scheduler = SendScheduler(global_rate=BOT_GLOBAL_RATE, chat_rate=BOT_CHAT_RATE, chat_burst=BOT_CHAT_BURST)
+
+# Картинки и видео шлём по file_id: Telegram не перекачивает их с Supabase на каждый показ
+media = MediaCache(os.path.join(DATA_DIR, "media.json"))
+
+# Рассылки идут фоновой полосой SendScheduler и не тормозят ответы пользователям
+broadcast = Broadcast(
+    supabase, os.path.join(DATA_DIR, "broadcast.json"),
+    concurrency=BROADCAST_CONCURRENCY,
+    active_days=BROADCAST_ACTIVE_DAYS,
+)
+
+# --- CALLBACK_DATA ---
+# Кнопки кодируются как '<версия><код>:арг:...', коды уже разосланных кнопок не переиспользовать
+router = CallbackRouter()
+router.action('to_start', 'h')
+router.action('shavasana', 'w')
+router.action('menu_learn', 'ml')
+router.action('menu_test', 'mt')
+router.action('menu_donate', 'md')
+router.action('select_series', 'ls', int)
+router.action('learn', 'l', int)
+router.action('nav', 'n', int)  # шаг: 1 или -1
+router.action('noop', '_')
+router.action('view_all', 'v', int, int)  # серия, смещение
+router.action('info', 'i', int)
+router.action('pretest', 'p', opt_int)  # None = микс
+router.action('start_test', 't', opt_int)
+router.action('answer', 'a', int, int)  # правильная асана, выбранная
+router.action('growth', 'g')
+router.action('srs', 'r', int)
+router.action('srs_show', 'rs', int)
+router.action('srs_grade', 'rg', int, int)  # асана, оценка
+cb = router.encode
+
+# Производные от каталога структуры пересобираются сами при смене его версии
+listing = SeriesListing(catalog, cb)
+search = SearchIndex(catalog)
 
 # --- ШАВАСАНА ---
 
@@ -97,235 +180,264 @@ async def send_shavasana(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    img_id = random.randint(1, 11)
-    img_url = f"https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Wishes/{img_id}.png"
+    img_url = random.choice(WISH_IMAGES)
 
-    await query.message.reply_photo(
-        photo=img_url,
+    await media.send(
+        query.message.reply_photo, img_url,
         caption="✨ Твое пожелание на сегодня. Намасте! 🙏"
     )
 
     uid = update.effective_user.id
-    user_data.pop(uid, None)
-    test_data.pop(uid, None)
+    analytics.touch_user(uid)
+    learn_sessions.pop(uid)
+    test_sessions.pop(uid)
 
-    return await start(update, context)
+    # Меню должно оказаться под пожеланием, поэтому здесь не правим старое сообщение, а шлём новое
+    txt, kb = main_menu()
+    try:
+        await query.message.delete()
+    except:
+        pass
+    await query.message.reply_text(txt, reply_markup=kb)
+    return ConversationHandler.END
 
 
 
 # --- ГЛАВНОЕ МЕНЮ ---
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def main_menu():
     kb = [
-        [InlineKeyboardButton("🧘 Учить асаны", callback_data='menu_learn')],
-        [InlineKeyboardButton("💪 Проверить мастерство", callback_data='menu_test')],
-        [InlineKeyboardButton("☕️ Поддержать проект", callback_data='menu_donate')]
+        [InlineKeyboardButton("🧘 Учить асаны", callback_data=cb('menu_learn'))],
+        [InlineKeyboardButton("💪 Проверить мастерство", callback_data=cb('menu_test'))],
+        [InlineKeyboardButton("☕️ Поддержать проект", callback_data=cb('menu_donate'))]
     ]
     txt = '🙏 Добро пожаловать в бот для изучения асан Аштанга Йоги!\nВыберите режим:'
+    return txt, InlineKeyboardMarkup(kb)
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt, kb = main_menu()
 
     uid = update.effective_user.id
-    await upsert_user(uid)
-    user_data.pop(uid, None)
-    test_data.pop(uid, None)
+    analytics.touch_user(uid)
+    learn_sessions.pop(uid)
+    test_sessions.pop(uid)
 
     if update.message:
-        await update.message.reply_text(txt, reply_markup=InlineKeyboardMarkup(kb))
+        await update.message.reply_text(txt, reply_markup=kb)
     else:
-        try:
-            await update.callback_query.message.delete()
-        except:
-            pass
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=txt, reply_markup=InlineKeyboardMarkup(kb))
+        await show_text(update.callback_query, txt, reply_markup=kb)
     return ConversationHandler.END
 
 async def to_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    kb = [
-        [InlineKeyboardButton("🧘 Учить асаны", callback_data='menu_learn')],
-        [InlineKeyboardButton("💪 Проверить мастерство", callback_data='menu_test')],
-        [InlineKeyboardButton("☕️ Поддержать проект", callback_data='menu_donate')]
-    ]
-    txt = '🙏 Добро пожаловать в бот для изучения асан Аштанга Йоги!\nВыберите режим:'
-    await query.message.delete()
-    await context.bot.send_message(chat_id=query.message.chat_id, text=txt, reply_markup=InlineKeyboardMarkup(kb))
+    txt, kb = main_menu()
+    await show_text(query, txt, reply_markup=kb)
     return ConversationHandler.END
 
-async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def stale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Кнопки из старых сообщений (прошлый формат callback_data) просто возвращают в меню
+    query = update.callback_query
+    await query.answer("Кнопка устарела, открываю меню")
+    txt, kb = main_menu()
+    await show_text(query, txt, reply_markup=kb)
+    return ConversationHandler.END
+
+async def noop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+
+async def menu_learn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    kb = [
+        [InlineKeyboardButton("Первая серия", callback_data=cb('select_series', 1))],
+        [InlineKeyboardButton("Вторая серия", callback_data=cb('select_series', 2))],
+        [InlineKeyboardButton("Третья серия", callback_data=cb('select_series', 3))],
+        [InlineKeyboardButton("◀️ Назад", callback_data=cb('to_start'))]
+    ]
+    await show_text(query, '🧘 Выберите серию для изучения:', reply_markup=InlineKeyboardMarkup(kb))
 
-    if query.data == 'menu_learn':
-        kb = [
-            [InlineKeyboardButton("Первая серия", callback_data='select_series_1')],
-            [InlineKeyboardButton("Вторая серия", callback_data='select_series_2')],
-            [InlineKeyboardButton("Третья серия", callback_data='select_series_3')],
-            [InlineKeyboardButton("◀️ Назад", callback_data='to_start')]
-        ]
-        await query.message.delete()
-        await context.bot.send_message(chat_id=query.message.chat_id, text='🧘 Выберите серию для изучения:', reply_markup=InlineKeyboardMarkup(kb))
-
-    elif query.data == 'menu_donate':
-        # Ваш текст с форматированием
-        donate_text = (
-            "Этот ботик был сделан из любви к Аштанге и комьюнити 🙏🏼\n\n"
-            "Знание названий асан не изменит вашу жизнь (тут уж придется самим стараться 💪🏽), "
-            "но поможет глубже понять практику и не растеряться, "
-            "когда учитель попросит еще раз повторить бхуджапидасану 👹\n\n"
-            "*Если этот ботик был полезным и вы хотите отблагодарить его создательницу - жмите на донат. "
-            "Ботик сможет стать лучше, как и вы 💙*\n\n"
-            "_Продолжайте практиковать! And all, как мы знаем, is coming 🙌🏽_"
-        )
+async def menu_donate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    # Ваш текст с форматированием
+    donate_text = (
+        "Этот ботик был сделан из любви к Аштанге и комьюнити 🙏🏼\n\n"
+        "Знание названий асан не изменит вашу жизнь (тут уж придется самим стараться 💪🏽), "
+        "но поможет глубже понять практику и не растеряться, "
+        "когда учитель попросит еще раз повторить бхуджапидасану 👹\n\n"
+        "*Если этот ботик был полезным и вы хотите отблагодарить его создательницу - жмите на донат. "
+        "Ботик сможет стать лучше, как и вы 💙*\n\n"
+        "_Продолжайте практиковать! And all, как мы знаем, is coming 🙌🏽_"
+    )
 
-        kb = [
-            [InlineKeyboardButton("🔥 Добаввить тапаса (CloudTips)", url="https://pay.cloudtips.ru/p/6b21b46b")],
-            [InlineKeyboardButton("◀️ В меню", callback_data='to_start')]
-        ]
+    kb = [
+        [InlineKeyboardButton("🔥 Добаввить тапаса (CloudTips)", url="https://pay.cloudtips.ru/p/6b21b46b")],
+        [InlineKeyboardButton("◀️ В меню", callback_data=cb('to_start'))]
+    ]
 
-        await query.message.delete()
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text=donate_text,
-            reply_markup=InlineKeyboardMarkup(kb),
-            parse_mode='Markdown'
-        )
+    await show_text(
+        query, donate_text,
+        reply_markup=InlineKeyboardMarkup(kb),
+        parse_mode='Markdown'
+    )
 
-    elif query.data.startswith('select_series_'):
-        series = int(query.data.split('_')[-1])
-        context.user_data['series'] = series
-        await query.message.delete()
+async def select_series(update: Update, context: ContextTypes.DEFAULT_TYPE, series: int):
+    query = update.callback_query
+    await query.answer()
+    context.user_data['series'] = series
 
-        kb = [
-            [InlineKeyboardButton("📖 Учить по порядку", callback_data=f'set_l_{series}')],
-            [InlineKeyboardButton("👀 Посмотреть асаны", callback_data=f'view_all_{series}_0')],
-            [InlineKeyboardButton("◀️ Назад", callback_data='menu_learn')]
-        ]
-        caption = (
-            f"{'Первая' if series==1 else 'Вторая' if series==2 else 'Третья'} серия. "
-            "Хотите следовать по серии или выбрать асаны из списка?"
-        )
-        await query.message.reply_photo(
-            photo=SERIES_IMAGES[series],
-            caption=caption,
-            reply_markup=InlineKeyboardMarkup(kb)
-        )
+    kb = [
+        [InlineKeyboardButton("📖 Учить по порядку", callback_data=cb('learn', series))],
+        [InlineKeyboardButton("🧠 Интервальное повторение", callback_data=cb('srs', series))],
+        [InlineKeyboardButton("👀 Посмотреть асаны", callback_data=cb('view_all', series, 0))],
+        [InlineKeyboardButton("◀️ Назад", callback_data=cb('menu_learn'))]
+    ]
+    caption = (
+        f"{'Первая' if series==1 else 'Вторая' if series==2 else 'Третья'} серия. "
+        "Хотите следовать по серии или выбрать асаны из списка?"
+    )
+    await show_photo(
+        query, media, SERIES_IMAGES[series],
+        caption=caption,
+        reply_markup=InlineKeyboardMarkup(kb)
+    )
 
-    elif query.data == 'menu_test':
-        kb = [
-            [InlineKeyboardButton("Первая серия", callback_data='pretest_1')],
-            [InlineKeyboardButton("Вторая серия", callback_data='pretest_2')],
-            [InlineKeyboardButton("Третья серия", callback_data='pretest_3')],
-            [InlineKeyboardButton("Микс", callback_data='pretest_mix')],
-            [InlineKeyboardButton("◀️ Назад", callback_data='to_start')]
-        ]
-        await query.message.delete()
-        await context.bot.send_message(chat_id=query.message.chat_id, text='💪 Выберите серию для теста:', reply_markup=InlineKeyboardMarkup(kb))
+async def menu_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    kb = [
+        [InlineKeyboardButton("Первая серия", callback_data=cb('pretest', 1))],
+        [InlineKeyboardButton("Вторая серия", callback_data=cb('pretest', 2))],
+        [InlineKeyboardButton("Третья серия", callback_data=cb('pretest', 3))],
+        [InlineKeyboardButton("Микс", callback_data=cb('pretest', None))],
+        [InlineKeyboardButton("◀️ Назад", callback_data=cb('to_start'))]
+    ]
+    await show_text(query, '💪 Выберите серию для теста:', reply_markup=InlineKeyboardMarkup(kb))
 
 # --- ЛОГИКА ТЕСТА ---
-async def pre_test_screen(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def pre_test_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, series: int = None):
     query = update.callback_query
     await query.answer()
     uid = query.from_user.id
-    user_id = await upsert_user(uid)
-    await log_interaction(user_id, 'test', 10)
-    series_type = query.data.split('_')[-1]
-    img_key = int(series_type) if series_type.isdigit() else 'mix'
-    kb = [[InlineKeyboardButton("🚀 Вперед!", callback_data=f"start_test_{series_type}")],
-          [InlineKeyboardButton("◀️ Назад", callback_data="menu_test")]]
-    await query.message.delete()
-    await query.message.reply_photo(photo=SERIES_IMAGES[img_key], caption="Крепкая мулабандха поможет вам ответить на следующие 10 вопросов 🦾 ", reply_markup=InlineKeyboardMarkup(kb))
-
-async def init_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    analytics.touch_user(uid)
+    analytics.log_interaction(uid, 'test', 10)
+    kb = [[InlineKeyboardButton("🚀 Вперед!", callback_data=cb('start_test', series))],
+          [InlineKeyboardButton("◀️ Назад", callback_data=cb('menu_test'))]]
+    await show_photo(query, media, SERIES_IMAGES[series or 'mix'], caption="Крепкая мулабандха поможет вам ответить на следующие 10 вопросов 🦾 ", reply_markup=InlineKeyboardMarkup(kb))
+
+async def init_test(update: Update, context: ContextTypes.DEFAULT_TYPE, series: int = None):
     query = update.callback_query
     await query.answer()
     uid = query.from_user.id
-    s_val = query.data.split('_')[-1]
-    series = int(s_val) if s_val.isdigit() else None
-    all_asanas = await fetch_asanas(series)
-    selected = random.sample(all_asanas, min(10, len(all_asanas)))
-    test_data[uid] = {'pool': all_asanas, 'questions': selected, 'index': 0, 'errors': [], 'score': 0}
-    await query.message.delete()
-    await send_q(query.message, uid)
-
-async def send_q(msg, uid, is_growth=False):
-    data = test_data.get(uid)
+    test_sessions.set(uid, {'series': series, 'questions': quiz.make_test(series, uid=uid), 'index': 0, 'errors': [], 'score': 0})
+    await send_q(query.message, uid, query=query)
+
+async def send_q(msg, uid, is_growth=False, query=None):
+    data = test_sessions.get(uid)
+    if data:
+        # Асану могли убрать из каталога посреди теста: такой вопрос пропускаем
+        questions, i = data['questions'], data['index']
+        while i < len(questions) and not all(catalog.get(aid) for aid in questions[i]):
+            del questions[i]
     if not data or data['index'] >= len(data['questions']):
         await finish_test(msg, uid)
         return
-    q = data['questions'][data['index']]
-    others = [a for a in data['pool'] if a['id'] != q['id']]
-    options = random.sample(others, 2) + [q]
-    random.shuffle(options)
-    kb = [[InlineKeyboardButton(opt['name'], callback_data=f"ans_{q['id']}_{opt['id']}")] for opt in options]
+    qid, *option_ids = data['questions'][data['index']]
+    q = catalog.get(qid)
+    options = [catalog.get(oid) for oid in option_ids]
+    kb = [[InlineKeyboardButton(opt['name'], callback_data=cb('answer', q['id'], opt['id']))] for opt in options]
+    data['asked'] = time.time()  # для времени ответа в статистике
+    test_sessions.save(uid)
     cap = "🌱 Точка роста! Вспомни название:" if is_growth else f"Вопрос {data['index']+1}/10\nКак называется эта асана?"
-    await msg.reply_photo(q['image_url'], caption=cap, reply_markup=InlineKeyboardMarkup(kb))
+    if query:
+        await show_photo(query, media, q['image_url'], caption=cap, reply_markup=InlineKeyboardMarkup(kb))
+    else:
+        await media.send(msg.reply_photo, q['image_url'], caption=cap, reply_markup=InlineKeyboardMarkup(kb))
 
-async def check_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def check_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, correct_id: int, chosen_id: int):
     query = update.callback_query
     await query.answer()
     uid = query.from_user.id
-    data = test_data.get(uid)
+    data = test_sessions.get(uid)
     if not data: return
-    _, correct_id, chosen_id = query.data.split('_')
+    # Повторное нажатие и кнопки старых вопросов: засчитываем только текущий вопрос
+    if data['index'] >= len(data['questions']) or data['questions'][data['index']][0] != correct_id:
+        return
+    stats.record_answer(
+        uid, correct_id, correct_id == chosen_id,
+        latency=time.time() - data.get('asked', time.time()),
+        # Раунд «точек роста» переспрашивает уже пропущенные асаны, в точность и очки он не идёт
+        first=not data.get('growth') and correct_id not in data['errors'],
+        name=query.from_user.first_name,
+    )
     if correct_id == chosen_id:
-        if int(correct_id) not in data['errors']: data['score'] += 1
-        a = await get_asana_by_id(int(correct_id))
-        await query.edit_message_caption(f"Верно! ✅\n\n{a['name']}")
+        if correct_id not in data['errors']:
+            data['score'] += 1
+            srs.grade(uid, correct_id, 4)
+        a = catalog.get(correct_id)
         data['index'] += 1
+        test_sessions.save(uid)
+        await query.edit_message_caption(f"Верно! ✅\n\n{a['name']}")
         await send_q(query.message, uid)
     else:
-        if int(correct_id) not in data['errors']: data['errors'].append(int(correct_id))
+        if correct_id not in data['errors']:
+            data['errors'].append(correct_id)
+            test_sessions.save(uid)
+            srs.grade(uid, correct_id, 1)
         if "❌" not in query.message.caption:
             await query.edit_message_caption(query.message.caption + "\n\nВыбрано неверно ❌ Попробуйте еще раз!", reply_markup=query.message.reply_markup)
 
 async def finish_test(msg, uid):
-    data = test_data.get(uid)
+    data = test_sessions.get(uid)
+    if not data:
+        return
+    if not data.get('growth') and not data.get('recorded'):
+        stats.record_test(uid, data['score'])
+        data['recorded'] = True
+        test_sessions.save(uid)
     if not data['errors']:
-        video = "https://zhsqobhlvtarkksnwsfy.supabase.co/storage/v1/object/public/Other/IMG_4867.MP4"
-        await msg.reply_video(video=video, caption="🎉 Безупречно! Теперь вы еще на один шаг ближе к самадхи!")
-        kb = [[InlineKeyboardButton("🔄 Еще раз", callback_data='menu_test')],
-              [InlineKeyboardButton("🏠 Меню", callback_data='to_start')],
-              [InlineKeyboardButton("🧘 Шавасана", callback_data='shavasana')]]
+        await media.send(msg.reply_video, FINISH_VIDEO, caption="🎉 Безупречно! Теперь вы еще на один шаг ближе к самадхи!")
+        kb = [[InlineKeyboardButton("🔄 Еще раз", callback_data=cb('menu_test'))],
+              [InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))],
+              [InlineKeyboardButton("🧘 Шавасана", callback_data=cb('shavasana'))]]
     else:
         txt = f"🏁 Тест окончен!\n📊 Ваш счёт: {data['score']} из {len(data['questions'])}"
         await msg.reply_text(txt)
-        kb = [[InlineKeyboardButton("🌱 Точки роста", callback_data='growth')],
-              [InlineKeyboardButton("🔄 Еще раз", callback_data='menu_test')],
-              [InlineKeyboardButton("🏠 Меню", callback_data='to_start')],
-              [InlineKeyboardButton("🧘 Шавасана", callback_data='shavasana')]]
+        kb = [[InlineKeyboardButton("🌱 Точки роста", callback_data=cb('growth'))],
+              [InlineKeyboardButton("🔄 Еще раз", callback_data=cb('menu_test'))],
+              [InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))],
+              [InlineKeyboardButton("🧘 Шавасана", callback_data=cb('shavasana'))]]
     await msg.reply_text("Что делаем дальше?", reply_markup=InlineKeyboardMarkup(kb))
 
 async def handle_growth(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     uid = query.from_user.id
-    data = test_data.get(uid)
-    err_asanas = [await get_asana_by_id(mid) for mid in data['errors']]
-    data.update({'questions': err_asanas, 'index': 0, 'errors': [], 'score': 0})
+    data = test_sessions.get(uid)
+    if not data:
+        return await start(update, context)
+    data.update({'questions': quiz.questions(data['errors'], data['series'], uid=uid), 'index': 0, 'errors': [], 'score': 0, 'growth': True})
+    test_sessions.save(uid)
     await query.message.reply_text("🚀 Работаем над вашими точками роста:")
     await send_q(query.message, uid, is_growth=True)
 
 # --- ЛОГИКА ОБУЧЕНИЯ ---
-async def start_learn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def start_learn(update: Update, context: ContextTypes.DEFAULT_TYPE, series: int):
     query = update.callback_query
     await query.answer()
     uid = query.from_user.id
-    user_id = await upsert_user(uid)
-    context.user_data['user_id'] = user_id
-    series = int(query.data.split('_')[-1])
+    analytics.touch_user(uid)
+    context.user_data['user_id'] = uid
     context.user_data['series'] = series
-    try:
-        await query.message.delete()
-    except:
-        pass
-    kb = [[InlineKeyboardButton("🏠 Меню", callback_data='to_start')]]
-    await context.bot.send_message(query.message.chat_id, f"С какой асаны начнём? Введите цифру (1-{SERIES_LIMITS[series]}):", reply_markup=InlineKeyboardMarkup(kb))
+    kb = [[InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))]]
+    await show_text(query, f"С какой асаны начнём? Введите цифру (1-{SERIES_LIMITS[series]}):", reply_markup=InlineKeyboardMarkup(kb))
     return ASK_START
 
 async def get_start_num(update: Update, context: ContextTypes.DEFAULT_TYPE):
     val = update.message.text
     if not val.isdigit(): return ASK_START
     context.user_data['start'] = int(val)
-    kb = [[InlineKeyboardButton("🏠 Меню", callback_data='to_start')]]
+    kb = [[InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))]]
     await update.message.reply_text(f"Начинаем с {val}. Какой асаной закончим? Введите цифру", reply_markup=InlineKeyboardMarkup(kb))
     return ASK_END
 
@@ -333,20 +445,15 @@ async def get_end_num(update: Update, context: ContextTypes.DEFAULT_TYPE):
     val = update.message.text
     if not val.isdigit(): return ASK_END
     s, e = context.user_data['start'], int(val)
-    asanas = await fetch_asanas(context.user_data['series'])
-    filtered = [a for a in asanas if s <= a['order_num'] <= e]
-    user_data[update.effective_user.id] = {'list': filtered, 'idx': 0}
+    filtered = catalog.range(context.user_data['series'], s, e)
+    learn_sessions.set(update.effective_user.id, {'ids': [a['id'] for a in filtered], 'idx': 0})
     user_id = context.user_data.get('user_id')
     if user_id:
-        await log_interaction(user_id, 'learn', len(filtered))
+        analytics.log_interaction(user_id, 'learn', len(filtered))
     await show_asana(update.message, update.effective_user.id)
     return ConversationHandler.END
 
-async def show_asana(msg, uid):
-    d = user_data.get(uid)
-    a = d['list'][d['idx']]
-    kb = [[InlineKeyboardButton("◀️", callback_data='prev'), InlineKeyboardButton(f"{d['idx']+1}/{len(d['list'])}", callback_data='none'), InlineKeyboardButton("▶️", callback_data='next')],
-          [InlineKeyboardButton("🏠 Меню", callback_data='to_start')]]
+def asana_caption(a):
     cap = f"🧘 *{a['name']}*"
     transcription = a.get('transcription') or ''
     if transcription:
@@ -354,98 +461,397 @@ async def show_asana(msg, uid):
     meaning = a.get('meaning') or ''
     if meaning:
         cap += f"\n\n{meaning}"
-    await msg.reply_photo(a['image_url'], caption=cap, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(kb))
+    return cap
+
+async def show_asana(msg, uid, query=None):
+    d = learn_sessions.get(uid)
+    a = catalog.get(d['ids'][d['idx']])
+    kb = [[InlineKeyboardButton("◀️", callback_data=cb('nav', -1)), InlineKeyboardButton(f"{d['idx']+1}/{len(d['ids'])}", callback_data=cb('noop')), InlineKeyboardButton("▶️", callback_data=cb('nav', 1))],
+          [InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))]]
+    cap = asana_caption(a)
+    if query:
+        await show_photo(query, media, a['image_url'], caption=cap, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(kb))
+    else:
+        await media.send(msg.reply_photo, a['image_url'], caption=cap, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(kb))
 
-async def nav_learn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def nav_learn(update: Update, context: ContextTypes.DEFAULT_TYPE, step: int):
     query = update.callback_query
     await query.answer()
     uid = query.from_user.id
-    if query.data == 'next': user_data[uid]['idx'] += 1
-    elif query.data == 'prev': user_data[uid]['idx'] = max(0, user_data[uid]['idx'] - 1)
+    d = learn_sessions.get(uid)
+    if not d:
+        return await start(update, context)
+    d['idx'] = max(0, d['idx'] + step)
+    learn_sessions.save(uid)
 
-    if user_data[uid]['idx'] >= len(user_data[uid]['list']):
+    if d['idx'] >= len(d['ids']):
         await query.message.reply_text("🎉 Все асаны изучены!", reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🏠 Меню", callback_data='to_start')],
-            [InlineKeyboardButton("🧘 Шавасана", callback_data='shavasana')]
+            [InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))],
+            [InlineKeyboardButton("🧘 Шавасана", callback_data=cb('shavasana'))]
         ]))
     else:
-        try:
-            await query.message.delete()
-        except:
-            pass
-        await show_asana(query.message, uid)
+        await show_asana(query.message, uid, query=query)
+
+# --- ИНТЕРВАЛЬНОЕ ПОВТОРЕНИЕ ---
+def until(ts):
+    left = max(0, ts - time.time())
+    if left < 3600:
+        return f"{int(left // 60) + 1} мин"
+    if left < 86400:
+        return f"{int(left // 3600)} ч"
+    return f"{int(left // 86400)} дн"
+
+async def show_srs_card(query, uid, series):
+    aid, info = srs.next_card(uid, series)
+    if aid is None:
+        txt = "🎉 Все асаны серии повторены!"
+        if info:
+            txt += f"\nСледующее повторение через {until(info)}"
+        kb = [[InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))]]
+        await show_text(query, txt, reply_markup=InlineKeyboardMarkup(kb))
+        return
+    a = catalog.get(aid)
+    kb = [[InlineKeyboardButton("👀 Показать название", callback_data=cb('srs_show', aid))],
+          [InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))]]
+    cap = "🆕 Новая асана! Знаете, как она называется?" if info else "🧠 Вспомните название асаны"
+    await show_photo(query, media, a['image_url'], caption=cap, reply_markup=InlineKeyboardMarkup(kb))
+
+async def srs_start(update: Update, context: ContextTypes.DEFAULT_TYPE, series: int):
+    query = update.callback_query
+    await query.answer()
+    uid = query.from_user.id
+    analytics.touch_user(uid)
+    await show_srs_card(query, uid, series)
 
-async def view_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def srs_show(update: Update, context: ContextTypes.DEFAULT_TYPE, aid: int):
     query = update.callback_query
+    a = catalog.get(aid)
+    if a is None:  # асану убрали из каталога
+        return await stale_callback(update, context)
     await query.answer()
-    data_parts = query.data.split('_')
-    series, offset = int(data_parts[2]), int(data_parts[3])
-    all_a = await fetch_asanas(series)
-    page = all_a[offset:offset+10]
-    kb = [[InlineKeyboardButton(f"{a['order_num']}. {a['name']}", callback_data=f"info_{a['id']}")] for a in page]
-    nav = []
-    if offset > 0: nav.append(InlineKeyboardButton("◀️", callback_data=f"view_all_{series}_{offset-10}"))
-    if offset + 10 < len(all_a): nav.append(InlineKeyboardButton("▶️", callback_data=f"view_all_{series}_{offset+10}"))
-    kb.append(nav)
-    kb.append([InlineKeyboardButton("🏠 Меню", callback_data='to_start')])
-    await query.message.edit_caption(caption="📋 Список асан серии:", reply_markup=InlineKeyboardMarkup(kb))
-
-async def show_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    kb = [[InlineKeyboardButton("🔁 Не помню", callback_data=cb('srs_grade', aid, 1)),
+           InlineKeyboardButton("🤔 С трудом", callback_data=cb('srs_grade', aid, 3)),
+           InlineKeyboardButton("✅ Помню", callback_data=cb('srs_grade', aid, 5))],
+          [InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))]]
+    await query.edit_message_caption(asana_caption(a), parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(kb))
+
+async def srs_grade(update: Update, context: ContextTypes.DEFAULT_TYPE, aid: int, quality: int):
     query = update.callback_query
+    a = catalog.get(aid)
+    if a is None:
+        return await stale_callback(update, context)
     await query.answer()
-    asana = await get_asana_by_id(int(query.data.split('_')[-1]))
-    await query.message.delete()
-    kb = [[InlineKeyboardButton("◀️ К списку", callback_data=f"view_all_{asana['series']}_0")]]
-    await query.message.reply_photo(photo=asana['image_url'], caption=f"🧘 {asana['name']}", reply_markup=InlineKeyboardMarkup(kb))
+    uid = query.from_user.id
+    srs.grade(uid, a['id'], quality)
+    await show_srs_card(query, uid, a['series'])
+
+async def view_all(update: Update, context: ContextTypes.DEFAULT_TYPE, series: int, offset: int):
+    query = update.callback_query
+    await query.answer()
+    kb = listing.page(series, offset)
+    if kb is None:
+        return await to_start_callback(update, context)
+    await query.message.edit_caption(caption="📋 Список асан серии:", reply_markup=kb)
+
+async def show_info(update: Update, context: ContextTypes.DEFAULT_TYPE, aid: int):
+    query = update.callback_query
+    asana = catalog.get(aid)
+    if asana is None:
+        return await stale_callback(update, context)
+    await query.answer()
+    kb = [[InlineKeyboardButton("◀️ К списку", callback_data=cb('view_all', asana['series'], 0))]]
+    await show_photo(query, media, asana['image_url'], caption=f"🧘 {asana['name']}", reply_markup=InlineKeyboardMarkup(kb))
+
+# --- INLINE-ПОИСК ---
+@functools.lru_cache(maxsize=1024)
+def inline_result(version, aid, file_id):
+    # version в ключе только для сброса кеша при обновлении каталога
+    a = catalog.get(aid)
+    caption = asana_caption(a)
+    if file_id:
+        return InlineQueryResultCachedPhoto(
+            str(aid), file_id, title=a['name'], description=a.get('transcription') or None,
+            caption=caption, parse_mode='Markdown'
+        )
+    return InlineQueryResultPhoto(
+        str(aid), a['image_url'], a['image_url'], title=a['name'],
+        description=a.get('transcription') or None, caption=caption, parse_mode='Markdown'
+    )
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.inline_query
+    ids = search.find(q.query) if q.query.strip() else [a['id'] for a in catalog.series(1)[:20]]
+    results = [inline_result(catalog.version, aid, media.get(catalog.get(aid)['image_url'])) for aid in ids]
+    await q.answer(results, cache_time=300)
+
+async def refresh_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if await catalog.refresh():
+        await update.message.reply_text(f"Каталог обновлён: v{catalog.version}, {len(catalog.rows)} асан")
+    else:
+        await update.message.reply_text("Не удалось обновить каталог, работаем на старых данных")
+
+async def warmup_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    chat_id = int(MEDIA_WARMUP_CHAT_ID) if MEDIA_WARMUP_CHAT_ID else update.effective_chat.id
+    urls = [a['image_url'] for a in catalog.rows] + list(dict.fromkeys(SERIES_IMAGES.values())) + WISH_IMAGES
+    todo = [url for url in urls if url and not media.get(url)]
+    await update.message.reply_text(f"Загружаю {len(todo)} файлов, в кеше уже {len(media)}")
+    uploads = [(context.bot.send_photo, url) for url in todo]
+    if not media.get(FINISH_VIDEO):
+        uploads.append((context.bot.send_video, FINISH_VIDEO))
+    failed = 0
+    for send, url in uploads:
+        try:
+            msg = await media.send(functools.partial(send, chat_id), url, disable_notification=True, rate_limit_args=BACKGROUND)
+            await context.bot.delete_message(chat_id, msg.message_id, rate_limit_args=BACKGROUND)
+        except Exception as e:
+            failed += 1
+            logging.warning(f"Warm-up failed for {url}: {e}")
+    await update.message.reply_text(f"Готово: в кеше {len(media)} файлов, ошибок {failed}")
+
+# --- СТАТИСТИКА ---
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    u = stats.user(uid)
+    if not u or not u.questions:
+        await update.message.reply_text("📊 Статистики пока нет: пройдите тест, и она появится здесь")
+        return
+    lines = [
+        "📊 Ваша статистика",
+        f"Вопросов: {u.questions}, верно с первой попытки: {round(u.accuracy * 100)}%",
+        f"Серия верных ответов: {u.streak} (рекорд {u.best_streak})",
+        f"Среднее время ответа: {u.avg_latency:.1f} с",
+        f"Тестов пройдено: {u.tests}, лучший результат: {u.best_score}",
+        f"Очков на этой неделе: {stats.weekly_points(uid)}",
+    ]
+    hardest = [catalog.get(aid) for aid in stats.hardest(uid)]
+    if any(hardest):
+        lines.append("🌱 Сложнее всего: " + ", ".join(a['name'] for a in hardest if a))
+    await update.message.reply_text("\n".join(lines))
+
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    top = stats.leaderboard()
+    if not top:
+        await update.message.reply_text("🏆 На этой неделе ещё никто не отвечал. Станьте первым!")
+        return
+    lines = ["🏆 Рейтинг недели (верно с первой попытки)"]
+    lines += [f"{i}. {name or 'Йог'} — {points}" for i, (_, name, points) in enumerate(top, 1)]
+    lines.append(f"\nВаши очки: {stats.weekly_points(update.effective_user.id)}")
+    hardest = [catalog.get(aid) for aid in stats.hardest()]
+    if any(hardest):
+        lines.append("Сложнее всего всем: " + ", ".join(a['name'] for a in hardest if a))
+    await update.message.reply_text("\n".join(lines))
+
+# --- РАССЫЛКИ ---
+def asana_of_day(day):
+    rows = sorted(catalog.rows, key=lambda a: a['id'])
+    return rows[day.toordinal() % len(rows)] if rows else None
+
+async def send_broadcast(bot, chat_id, payload):
+    if payload['kind'] == 'text':
+        return await bot.send_message(chat_id, payload['text'], rate_limit_args=BACKGROUND)
+    a = catalog.get(payload['aid'])
+    if not a:  # асану убрали из каталога: не отправлено, Broadcast посчитает как ошибку
+        raise LookupError(f"asana {payload['aid']} is not in the catalog")
+    kb = [[InlineKeyboardButton("🧘 Учить асаны", callback_data=cb('menu_learn'))]]
+    return await media.send(
+        functools.partial(bot.send_photo, chat_id), a['image_url'],
+        caption="🌅 Асана дня\n\n" + asana_caption(a), parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(kb), rate_limit_args=BACKGROUND
+    )
+
+async def run_broadcast(bot, name, payload, notify=None):
+    try:
+        await broadcast.run(name, payload, functools.partial(send_broadcast, bot))
+    except Exception as e:
+        logging.error(f"Broadcast {name} failed: {e}")
+    if notify:
+        await bot.send_message(notify, broadcast.describe())
+
+async def daily_reminders(bot):
+    while True:
+        now = datetime.now(timezone.utc)
+        at = now.replace(hour=DAILY_REMINDER_HOUR, minute=0, second=0, microsecond=0)
+        if at <= now:
+            at += timedelta(days=1)
+        await asyncio.sleep((at - now).total_seconds())
+        a = asana_of_day(at.date())
+        if a:
+            await run_broadcast(bot, f"daily-{at.date().isoformat()}", {'kind': 'asana', 'aid': a['id']})
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    text = update.message.text.partition(' ')[2].strip()
+    if not text or broadcast.running:
+        await update.message.reply_text(broadcast.describe())
+        return
+    background_tasks.append(asyncio.create_task(run_broadcast(
+        context.bot, f"manual-{int(time.time())}", {'kind': 'text', 'text': text}, notify=update.effective_chat.id
+    )))
+    await update.message.reply_text("Рассылка запущена, прогресс: /broadcast")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logging.error(f"Exception while handling an update: {context.error}")
 
 # --- MAIN ---
-def main():
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+async def post_init(app: Application):
+    await supabase.start()
+    await analytics.start()
+    # Со снимком стартуем без сети, а свежие данные подтянет фоновое обновление
+    if catalog.load_snapshot(catalog.snapshot_path, CATALOG_SNAPSHOT):
+        background_tasks.append(asyncio.create_task(catalog.refresh()))
+    else:
+        await catalog.refresh()
+    catalog.start()
+    background_tasks.append(asyncio.create_task(evict_loop([learn_sessions, test_sessions], 600)))
+    stats.load()
+    stats.start()
+    # Прерванная рейстартом рассылка продолжается с чекпоинта
+    pending = broadcast.unfinished()
+    if pending:
+        background_tasks.append(asyncio.create_task(run_broadcast(app.bot, pending['name'], pending['payload'])))
+    if DAILY_REMINDER_HOUR is not None:
+        background_tasks.append(asyncio.create_task(daily_reminders(app.bot)))
+
+async def post_shutdown(app: Application):
+    for task in background_tasks:
+        task.cancel()
+    await catalog.stop()
+    await stats.stop()
+    await analytics.stop()
+    await supabase.close()
+
+async def health(request):
+    return json_response({
+        "status": "ok" if catalog.rows else "degraded",
+        "catalog_version": catalog.version,
+        "asanas": len(catalog.rows),
+        "analytics_pending": analytics.pending(),
+        "send_queue": send_scheduler.stats()["queue_depth"],
+        "broadcast": broadcast.progress(),
+    })
+
+async def slow_updates(request):
+    return json_response(metrics.slowest())
+
+def setup_metrics():
+    metrics.profile_rate = PROFILE_SAMPLE_RATE
+    metrics.gauge("bot_catalog_version", lambda: catalog.version)
+    metrics.gauge("bot_sessions", lambda: {(("kind", "learn"),): len(learn_sessions), (("kind", "test"),): len(test_sessions)})
+    metrics.gauge("bot_analytics_pending", analytics.pending)
+    metrics.gauge("bot_send_queue_depth", lambda: {(("lane", lane),): n for lane, n in send_scheduler.waiting.items()})
+    metrics.gauge("bot_media_cached", lambda: len(media))
+    metrics.gauge("bot_stats_pending", stats.pending)
+    metrics.gauge("bot_broadcast_messages", lambda: {
+        (("status", k),): broadcast.progress().get(k) or 0 for k in ("sent", "blocked", "failed")
+    })
+
+def build_app(token: str = TELEGRAM_TOKEN, request=None) -> Application:
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(ChatOrderedProcessor(CONCURRENT_UPDATES))
+        .rate_limiter(send_scheduler)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:  # подмена Bot API, например в bench/
+        builder = builder.request(request)
+    app = builder.build()
     app.add_error_handler(error_handler)
 
     app.add_handler(ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_learn, pattern='^set_l_')],
+        entry_points=[router.handler('learn', start_learn)],
         states={
             ASK_START: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, get_start_num),
-                CallbackQueryHandler(to_start_callback, pattern='^to_start$')
+                router.handler('to_start', to_start_callback)
             ],
             ASK_END: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, get_end_num),
-                CallbackQueryHandler(to_start_callback, pattern='^to_start$')
+                router.handler('to_start', to_start_callback)
             ]
         },
-        fallbacks=[CallbackQueryHandler(to_start_callback, pattern='^to_start$')],
+        fallbacks=[router.handler('to_start', to_start_callback)],
         per_message=False,
         allow_reentry=True
     ))
 
     app.add_handler(CommandHandler("start", start))
-    app.add_handler(CallbackQueryHandler(to_start_callback, pattern='^to_start$'))
-    app.add_handler(CallbackQueryHandler(send_shavasana, pattern='^shavasana$'))
-    app.add_handler(CallbackQueryHandler(handle_menu, pattern='^(menu_|select_series_)'))
-    app.add_handler(CallbackQueryHandler(pre_test_screen, pattern='^pretest_'))
-    app.add_handler(CallbackQueryHandler(init_test, pattern='^start_test_'))
-    app.add_handler(CallbackQueryHandler(check_answer, pattern='^ans_'))
-    app.add_handler(CallbackQueryHandler(handle_growth, pattern='^growth$'))
-    app.add_handler(CallbackQueryHandler(nav_learn, pattern='^(next|prev)$'))
-    app.add_handler(CallbackQueryHandler(view_all, pattern='^view_all_'))
-    app.add_handler(CallbackQueryHandler(show_info, pattern='^info_'))
+    app.add_handler(CommandHandler("refresh", refresh_catalog))
+    app.add_handler(CommandHandler("warmup", warmup_media))
+    app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("stats", show_stats))
+    app.add_handler(CommandHandler("top", show_leaderboard))
+    app.add_handler(InlineQueryHandler(inline_search))
+
+    # Все остальные кнопки: один обработчик, разбор callback_data по таблице кодов
+    router.route('to_start', to_start_callback)
+    router.route('shavasana', send_shavasana)
+    router.route('menu_learn', menu_learn)
+    router.route('menu_test', menu_test)
+    router.route('menu_donate', menu_donate)
+    router.route('select_series', select_series)
+    router.route('nav', nav_learn)
+    router.route('noop', noop)
+    router.route('view_all', view_all)
+    router.route('info', show_info)
+    router.route('pretest', pre_test_screen)
+    router.route('start_test', init_test)
+    router.route('answer', check_answer)
+    router.route('growth', handle_growth)
+    router.route('srs', srs_start)
+    router.route('srs_show', srs_show)
+    router.route('srs_grade', srs_grade)
+    router.fallback = stale_callback
+    app.add_handler(router.dispatcher())
+    metrics.instrument(app)
+    setup_metrics()
+    return app
+
+def main():
+    if ROLE != "bot" and not os.getenv("WEBHOOK_SECRET"):
+        raise SystemExit("ROLE=router/worker требует общий WEBHOOK_SECRET")
+    if ROLE == "router" and not (WEBHOOK_URL and SHARD_NODES):
+        raise SystemExit("ROLE=router требует WEBHOOK_URL и SHARD_NODES (адреса воркеров через запятую)")
+    if ROLE == "worker" and SHARD_COUNT < 2:
+        logging.warning("ROLE=worker без SHARD_COUNT или SHARD_NODES: берём весь лимит Telegram на одного воркера")
+
+    if ROLE == "router":
+        print(f"starting shard router for {len(SHARD_NODES)} workers")
+        asyncio.run(serve_router(
+            ShardRouter(SHARD_NODES, WEBHOOK_SECRET, WEBHOOK_PATH),
+            HttpServer("0.0.0.0", WEBHOOK_PORT),
+            TELEGRAM_TOKEN,
+            webhook_url=WEBHOOK_URL + WEBHOOK_PATH,
+            metrics_token=METRICS_TOKEN,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        ))
+        return
+
+    app = build_app()
 
     print("🤖 бот запущен и готов к работе!")
     print("WEBHOOK_URL =", WEBHOOK_URL)
 
-    if WEBHOOK_URL:
+    if WEBHOOK_URL or ROLE == "worker":
         print("starting webhook")
-        app.run_webhook(
-            listen="0.0.0.0",
-            port=8080,
+        server = HttpServer("0.0.0.0", WEBHOOK_PORT)
+        server.route("GET", "/health", health)
+        server.route("GET", "/metrics", require_token(metrics_endpoint, METRICS_TOKEN))
+        server.route("GET", "/debug/slow", require_token(slow_updates, METRICS_TOKEN))
+        asyncio.run(serve_webhook(
+            app, server,
             url_path=WEBHOOK_PATH,
-            webhook_url=WEBHOOK_URL + WEBHOOK_PATH,
-        )
+            # Воркер вебхук не регистрирует: апдейты ему пересылает роутер
+            webhook_url=WEBHOOK_URL + WEBHOOK_PATH if ROLE == "bot" else None,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        ))
     else:
         app.run_polling(drop_pending_updates=True)
 
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import unittest
+
+import httpx
+
+from utils.analytics import AnalyticsWriter
+from utils.supabase import Supabase
+
+
+class AnalyticsWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.status = {}   # таблица -> код ответа
+        self.posts = []
+        self.supabase = Supabase("https://test.local", "key", http2=False, retries=0,
+                                 transport=httpx.MockTransport(self.handle))
+        self.spool = os.path.join(tempfile.mkdtemp(), "analytics.spool")
+        self.writer = AnalyticsWriter(self.supabase, self.spool)
+        await self.writer.start()
+        self.writer._task.cancel()  # flush вызываем вручную
+
+    async def asyncTearDown(self):
+        await self.writer.stop()
+        await self.supabase.close()
+
+    def handle(self, request: httpx.Request):
+        table = request.url.path.rsplit("/", 1)[-1]
+        self.posts.append((table, json.loads(request.content)))
+        return httpx.Response(self.status.get(table, 201), text="error")
+
+    def rejected(self):
+        path = self.spool + ".rejected"
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    async def test_rejected_rows_are_dead_lettered_not_retried(self):
+        self.status["interactions"] = 400
+        self.writer.log_interaction(1, "learn", 5)
+        self.writer.touch_user(1)
+        await self.writer.flush()
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(self.writer._failures, 0)
+        self.assertEqual([e["t"] for e in self.rejected()], ["interactions"])
+        await self.writer.flush()
+        self.assertEqual(len(self.posts), 2)  # повторной отправки нет
+
+    async def test_server_errors_are_retried_with_backoff(self):
+        self.status["interactions"] = 503
+        self.writer.log_interaction(1, "test", 10)
+        await self.writer.flush()
+        self.assertEqual((self.writer.pending(), self.writer._failures), (1, 1))
+        self.assertEqual(self.rejected(), [])
+        del self.status["interactions"]
+        await self.writer.flush()
+        self.assertEqual((self.writer.pending(), self.writer._failures), (0, 0))
+        self.assertEqual([table for table, _ in self.posts], ["interactions", "interactions"])
+
+    async def test_requeued_user_row_does_not_overwrite_newer_one(self):
+        self.status["users"] = 503
+        self.writer._add({"t": "users", "row": {"chat_id": 1, "latest_interaction": "2026-01-01T10:00:00+00:00"}})
+        await self.writer.flush()
+        newer = {"chat_id": 1, "latest_interaction": "2026-01-01T11:00:00+00:00"}
+        self.writer._add({"t": "users", "row": newer})
+        self.writer._add({"t": "users", "row": {"chat_id": 1, "latest_interaction": "2026-01-01T10:00:00+00:00"}})
+        self.assertEqual(self.writer._users[1], newer)
+
+    async def test_spool_replay_keeps_newest_user_row(self):
+        await self.writer.stop()
+        with open(self.spool, "w", encoding="utf-8") as f:
+            for ts in ("11:00", "10:00"):  # старая строка дописана позже после неудачной отправки
+                row = {"chat_id": 1, "latest_interaction": f"2026-01-01T{ts}:00+00:00"}
+                f.write(json.dumps({"t": "users", "row": row}) + "\n")
+        self.status["users"] = 503
+        writer = AnalyticsWriter(self.supabase, self.spool)
+        await writer.start()
+        writer._task.cancel()
+        self.assertEqual(writer._users[1]["latest_interaction"], "2026-01-01T11:00:00+00:00")
+        self.writer = writer
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import itertools
+import os
+import tempfile
+import unittest
+
+# main читает настройки из окружения при импорте, как и bench/run.py
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="asana-tests-"))
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("SUPABASE_URL", "https://bench.local")
+os.environ.setdefault("SUPABASE_KEY", "tests")
+
+from telegram import Update  # noqa: E402
+
+import main  # noqa: E402
+from bench.fakes import FakeBotApi, make_asanas  # noqa: E402
+from utils.ratelimit import SendScheduler  # noqa: E402
+
+UID = 4242
+USER = {"id": UID, "is_bot": False, "first_name": "u"}
+
+
+class AnswerTapTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        if not main.catalog.rows:
+            main.catalog._build(make_asanas())
+        self.bot_api = FakeBotApi()
+        main.send_scheduler = SendScheduler(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+        self.app = main.build_app(token="123456:TEST", request=self.bot_api)
+        await self.app.initialize()
+        self.ids = itertools.count(1)
+        questions = main.quiz.make_test(1, n=3, uid=UID)
+        main.test_sessions.set(UID, {'series': 1, 'questions': questions, 'index': 0, 'errors': [], 'score': 0})
+
+    async def asyncTearDown(self):
+        main.test_sessions.pop(UID)
+        await self.app.shutdown()
+
+    async def tap(self, correct_id, chosen_id):
+        message = {"message_id": 1, "date": 0, "chat": {"id": UID, "type": "private"}, "caption": "Вопрос"}
+        await self.app.process_update(Update.de_json({"update_id": next(self.ids), "callback_query": {
+            "id": str(next(self.ids)), "from": USER, "chat_instance": "1", "message": message,
+            "data": main.router.encode('answer', correct_id, chosen_id),
+        }}, self.app.bot))
+
+    def session(self):
+        return main.test_sessions.get(UID)
+
+    async def test_duplicate_tap_does_not_skip_a_question(self):
+        first = self.session()['questions'][0][0]
+        await self.tap(first, first)
+        await self.tap(first, first)  # двойное нажатие на ту же кнопку
+        self.assertEqual((self.session()['index'], self.session()['score']), (1, 1))
+
+    async def test_tap_on_old_question_is_ignored(self):
+        first, second = (q[0] for q in self.session()['questions'][:2])
+        await self.tap(first, first)
+        wrong = next(x for x in self.session()['questions'][0][1:] if x != first)
+        await self.tap(first, wrong)  # кнопка прошлого вопроса
+        self.assertEqual(self.session()['errors'], [])
+        await self.tap(second, second)
+        self.assertEqual((self.session()['index'], self.session()['score']), (2, 2))
+
+    async def test_growth_round_stays_out_of_stats(self):
+        first = self.session()['questions'][0][0]
+        await self.tap(first, first)
+        before = main.stats.user(UID).questions, main.stats.weekly_points(UID)
+        main.test_sessions.set(UID, {**self.session(), 'questions': main.quiz.questions([first], 1, uid=UID),
+                                     'index': 0, 'errors': [], 'score': 0, 'growth': True})
+        wrong = next(x for x in self.session()['questions'][0][1:] if x != first)
+        await self.tap(first, wrong)
+        await self.tap(first, first)
+        self.assertEqual((main.stats.user(UID).questions, main.stats.weekly_points(UID)), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from bench.fakes import make_asanas
+from utils.catalog import AsanaCatalog
+from utils.quiz import QuizBuilder
+
+
+def make_catalog():
+    catalog = AsanaCatalog(None)
+    catalog._build(make_asanas())
+    return catalog
+
+
+class QuizBuilderTest(unittest.TestCase):
+    def test_seeded_tests_do_not_depend_on_user_order(self):
+        catalog = make_catalog()
+        a, b = QuizBuilder(catalog, seed=7), QuizBuilder(catalog, seed=7)
+        first = {uid: a.make_test(1, uid=uid) for uid in (1, 2, 3)}
+        second = {uid: b.make_test(1, uid=uid) for uid in (3, 1, 2)}
+        self.assertEqual(first, second)
+        self.assertNotEqual(a.make_test(1, uid=1), first[1])  # следующий тест того же пользователя другой
+
+    def test_question_has_answer_among_distinct_options(self):
+        quiz = QuizBuilder(make_catalog(), seed=1)
+        for aid, *options in quiz.make_test(2, uid=1):
+            self.assertIn(aid, options)
+            self.assertEqual(len(set(options)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
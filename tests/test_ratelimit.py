@@ -0,0 +1,26 @@
+import asyncio
+import unittest
+
+from utils.ratelimit import BACKGROUND, SendScheduler
+
+
+class SendSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def send(self, scheduler, chat_id, lane=None):
+        async def call():
+            return True
+
+        return await scheduler.process_request(call, (), {}, "sendMessage", {"chat_id": chat_id}, lane)
+
+    async def test_background_goes_through_at_low_global_rate(self):
+        for rate in (1, 0.5, 1.2):
+            scheduler = SendScheduler(global_rate=rate)
+            self.assertTrue(await asyncio.wait_for(self.send(scheduler, 1, BACKGROUND), 3))
+
+    async def test_background_keeps_reserve_for_interactive(self):
+        scheduler = SendScheduler(global_rate=30)
+        self.assertGreater(scheduler.background_reserve, 1)
+        self.assertLess(scheduler.background_reserve, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import time
+import unittest
+
+from telegram import Update
+
+from utils.server import ChatOrderedProcessor, HttpServer, Request, require_token
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "x",
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "u"},
+        },
+    }, None)
+
+
+class ChatOrderedProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def submit(self, processor, updates, handle):
+        # Как Application при concurrent_updates: по задаче на апдейт в порядке поступления
+        return [asyncio.create_task(processor.process_update(u, handle(u))) for u in updates]
+
+    async def test_busy_chat_does_not_block_other_chats(self):
+        processor = ChatOrderedProcessor(4)
+        done = {}
+
+        async def handle(update):
+            if update.effective_chat.id == 1:
+                await asyncio.sleep(0.1)
+            done[update.update_id] = time.perf_counter()
+
+        started = time.perf_counter()
+        burst = [make_update(i, chat_id=1) for i in range(1, 7)]
+        tasks = await self.submit(processor, burst + [make_update(100, chat_id=2)], handle)
+        await asyncio.gather(*tasks)
+        while len(done) < 7:
+            await asyncio.sleep(0.01)
+
+        self.assertLess(done[100] - started, 0.05)
+        self.assertEqual(sorted(done, key=done.get)[1:], list(range(1, 7)))
+
+    async def test_updates_of_one_chat_run_in_order(self):
+        processor = ChatOrderedProcessor(8)
+        order = []
+
+        async def handle(update):
+            await asyncio.sleep(0.01 if update.update_id % 2 else 0)
+            order.append(update.update_id)
+
+        tasks = await self.submit(processor, [make_update(i, chat_id=5) for i in range(10)], handle)
+        await asyncio.gather(*tasks)
+        while len(order) < 10:
+            await asyncio.sleep(0.01)
+        self.assertEqual(order, list(range(10)))
+
+
+class HttpServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = HttpServer("127.0.0.1", 0, read_timeout=0.1, idle_timeout=0.2, max_connections=1)
+
+        async def ok(request):
+            return 200, "text/plain", b"ok"
+
+        self.server.route("GET", "/health", ok)
+        await self.server.start()
+        self.port = self.server._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    async def test_idle_and_slow_connections_are_closed(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertIn(b"200", await reader.readline())
+        await reader.readuntil(b"ok")
+        self.assertEqual(await asyncio.wait_for(reader.read(), 1), b"")  # простой дольше idle_timeout
+        writer.close()
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(b"GET /health HTTP/1.1\r\n")  # заголовки так и не приходят
+        self.assertEqual(await asyncio.wait_for(reader.read(), 1), b"")
+        writer.close()
+
+    async def test_connections_over_limit_are_rejected(self):
+        _, first = await asyncio.open_connection("127.0.0.1", self.port)
+        await asyncio.sleep(0.01)
+        reader, second = await asyncio.open_connection("127.0.0.1", self.port)
+        self.assertIn(b"503", await asyncio.wait_for(reader.readline(), 1))
+        first.close()
+        second.close()
+
+
+class RequireTokenTest(unittest.IsolatedAsyncioTestCase):
+    async def test_only_bearer_token_passes(self):
+        async def metrics(request):
+            return 200, "text/plain", b"data"
+
+        handler = require_token(metrics, "s3cret")
+        for headers, status in (({}, 401), ({"authorization": "Bearer nope"}, 401),
+                                ({"authorization": "Bearer s3cret"}, 200)):
+            result = await handler(Request("GET", "/metrics", headers, b""))
+            self.assertEqual(result[0], status)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import sqlite3
+import unittest
+
+from bench.fakes import make_asanas
+from utils.catalog import AsanaCatalog
+from utils.srs import MIN_EASE, RELEARN_DELAY, START_EASE, SrsEngine
+
+NOW = 1_700_000_000
+
+
+def make_engine(conn=None):
+    catalog = AsanaCatalog(None)
+    catalog._build(make_asanas())
+    return SrsEngine(catalog, conn)
+
+
+class SrsEngineTest(unittest.TestCase):
+    def card(self, srs, uid, aid):
+        cards = srs._cards(uid)
+        return round(cards.ease[aid], 2), cards.interval[aid], cards.reps[aid], cards.due[aid]
+
+    def test_intervals_grow_on_recall(self):
+        srs = make_engine()
+        self.assertEqual(srs.grade(1, 5, 5, now=NOW), NOW + 86400)
+        self.assertEqual(srs.grade(1, 5, 4, now=NOW), NOW + 6 * 86400)
+        self.assertEqual(self.card(srs, 1, 5)[:3], (2.6, 6.0, 2))
+
+    def test_lapse_relearns_without_touching_ease(self):
+        srs = make_engine()
+        srs.grade(1, 5, 3, now=NOW)
+        ease = self.card(srs, 1, 5)[0]
+        self.assertLess(ease, START_EASE)
+        for _ in range(5):
+            self.assertEqual(srs.grade(1, 5, 1, now=NOW), NOW + RELEARN_DELAY)
+        self.assertEqual(self.card(srs, 1, 5), (ease, 0.0, 0, NOW + RELEARN_DELAY))
+
+    def test_ease_never_drops_below_minimum(self):
+        srs = make_engine()
+        for _ in range(20):
+            srs.grade(1, 5, 3, now=NOW)
+        self.assertGreaterEqual(self.card(srs, 1, 5)[0], MIN_EASE - 0.001)
+
+    def test_due_card_comes_before_new_ones(self):
+        srs = make_engine()
+        first = srs.catalog.series(1)[0]['id']
+        self.assertEqual(srs.next_card(1, 1, now=NOW), (first, True))
+        srs.grade(1, first, 1, now=NOW)
+        self.assertEqual(srs.next_card(1, 1, now=NOW + RELEARN_DELAY), (first, False))
+
+    def test_grades_survive_restart(self):
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        make_engine(conn).grade(1, 5, 5, now=NOW)
+        self.assertEqual(self.card(make_engine(conn), 1, 5), (2.6, 1.0, 1, NOW + 86400))
+
+
+if __name__ == "__main__":
+    unittest.main()
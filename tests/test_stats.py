@@ -0,0 +1,67 @@
+import sqlite3
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from utils.stats import StatsEngine
+
+# Среда, полдень UTC: вчерашние события уже подлежат свёртке, но неделя та же
+NOW = datetime(2026, 10, 14, 12, tzinfo=timezone.utc).timestamp()
+DAY = 86400
+
+
+def make_stats(conn=None, **kwargs):
+    return StatsEngine(catalog=None, conn=conn, **kwargs)
+
+
+class StatsEngineTest(unittest.TestCase):
+    def test_only_first_attempts_count(self):
+        stats = make_stats()
+        stats.record_answer(1, 10, False, latency=2.0, first=True, now=NOW)
+        stats.record_answer(1, 10, True, latency=1.0, first=False, now=NOW)  # повтор после ошибки
+        stats.record_answer(1, 10, True, latency=1.0, first=False, now=NOW)  # раунд «точек роста»
+        u = stats.user(1)
+        self.assertEqual((u.questions, u.correct, u.streak), (1, 0, 0))
+        self.assertEqual(u.avg_latency, 2.0)
+        self.assertEqual(stats.weekly_points(1, now=NOW), 0)
+        self.assertEqual(stats.pending(), 3)  # сырые события пишутся все
+
+    def test_top_is_kept_incrementally(self):
+        stats = make_stats(top_size=2)
+        for uid, points in ((1, 3), (2, 1), (3, 2), (2, 4)):
+            for _ in range(points):
+                stats.record_answer(uid, 10, True, latency=1.0, first=True, name=f"u{uid}", now=NOW)
+        self.assertEqual(stats.leaderboard(now=NOW), [(2, "u2", 5), (1, "u1", 3)])
+        self.assertEqual(stats.leaderboard(now=NOW + 7 * DAY), [])  # новая неделя
+
+    def test_compact_keeps_aggregates_after_reload(self):
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        stats = make_stats(conn)
+        stats.record_answer(1, 10, True, latency=1.0, first=True, now=NOW - DAY)
+        stats.record_answer(1, 11, False, latency=3.0, first=True, now=NOW - DAY)
+        stats.record_answer(1, 11, True, latency=1.0, first=False, now=NOW - DAY)
+        stats.record_answer(1, 12, True, latency=2.0, first=True, now=NOW)
+        stats.record_test(1, 7)
+        stats.flush()
+
+        self.assertEqual(stats.compact(now=NOW), 3)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM answer_events").fetchone()[0], 1)
+
+        reloaded = make_stats(conn)
+        reloaded.load(now=NOW)
+        u = reloaded.user(1)
+        self.assertEqual((u.questions, u.correct, u.latency_ms, u.best_score), (3, 2, 6000, 7))
+        self.assertEqual(u.asanas[11], [1, 1])
+        self.assertEqual(reloaded.weekly_points(1, now=NOW), 2)
+
+    def test_failed_flush_keeps_events(self):
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        stats = make_stats(conn)
+        stats.record_answer(1, 10, True, latency=1.0, first=True, now=NOW)
+        conn.execute("DROP TABLE answer_events")
+        with self.assertRaises(sqlite3.OperationalError):
+            stats.flush()
+        self.assertEqual(stats.pending(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_4XX = {408, 429}
+
+
+class AnalyticsWriter:
+    """Отложенная запись аналитики: копим события в памяти и отправляем пачками.
+
+    Каждое событие сразу дописывается в локальный spool-файл, поэтому при падении
+    процесса ничего не теряется: на старте spool перечитывается и досылается.
+    Пачки, которые PostgREST отверг насовсем (4xx), откладываются в .rejected и не
+    повторяются; после неудачной отправки следующая попытка ждёт всё дольше.
+    """
+
+    def __init__(self, supabase, spool_path: str, flush_interval: float = 5.0, max_batch: int = 200,
+                 max_backoff: float = 300.0):
+        self.supabase = supabase
+        self.spool_path = spool_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self._failures = 0  # неудачных отправок подряд
+        self._users = {}
+        self._rows = {}
+        self._spool = None
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    # --- ПРИЁМ СОБЫТИЙ ---
+    def touch_user(self, chat_id: int):
+        self._add({"t": "users", "row": {"chat_id": chat_id, "latest_interaction": _now()}})
+
+    def log_interaction(self, user_id: int, interaction_type: str, num_asanas: int):
+        self.add_row("interactions", {"user_id": user_id, "type": interaction_type, "number_of_asanas": num_asanas})
+
+    def add_row(self, table: str, row: dict):
+        self._add({"t": table, "row": row})
+
+    def pending(self) -> int:
+        return len(self._users) + sum(len(rows) for rows in self._rows.values())
+
+    def _add(self, event: dict, wakeup: bool = True):
+        self._apply(event)
+        if self._spool is not None:
+            self._spool.write(json.dumps(event, ensure_ascii=False) + "\n")
+        # Во время сбоя полный буфер не торопит повтор: ждём backoff
+        if wakeup and not self._failures and self.pending() >= self.max_batch:
+            self._wakeup.set()
+
+    def _apply(self, event: dict):
+        if event["t"] == "users":
+            # По одному пользователю достаточно последнего latest_interaction. Сравниваем время,
+            # а не порядок: неотправленная старая строка возвращается в буфер и в spool позже новой
+            row = event["row"]
+            current = self._users.get(row["chat_id"])
+            if current is None or current["latest_interaction"] <= row["latest_interaction"]:
+                self._users[row["chat_id"]] = row
+        else:
+            self._rows.setdefault(event["t"], []).append(event["row"])
+
+    # --- ЖИЗНЕННЫЙ ЦИКЛ ---
+    async def start(self):
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        recovered = self._load(self._flushing_path) + self._load(self.spool_path)
+        self._open_spool()
+        for event in recovered:
+            self._add(event)
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} analytics events from spool")
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    async def _loop(self):
+        while True:
+            if self._failures:
+                await asyncio.sleep(min(self.flush_interval * 2 ** min(self._failures, 10), self.max_backoff))
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # --- ОТПРАВКА ---
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.pending():
+                return
+            users, rows = list(self._users.values()), self._rows
+            self._users, self._rows = {}, {}
+            self._rotate_spool()
+
+            failed, rejected = [], []
+            batches = [("users", users, "chat_id")] if users else []
+            batches += [(table, batch, None) for table, batch in rows.items()]
+            for table, batch, on_conflict in batches:
+                try:
+                    r = await self.supabase.insert(table, batch, on_conflict=on_conflict)
+                except Exception as e:
+                    logger.warning(f"Analytics flush to {table} failed: {e!r}")
+                    failed += [{"t": table, "row": row} for row in batch]
+                    continue
+                if r.status_code < 300:
+                    continue
+                events = [{"t": table, "row": row} for row in batch]
+                if 400 <= r.status_code < 500 and r.status_code not in RETRYABLE_4XX:
+                    # Повтор ничего не изменит (схема, ограничения, права): не блокируем очередь
+                    logger.error(f"Analytics rows for {table} rejected -> {r.status_code}: {r.text[:200]}")
+                    rejected += events
+                else:
+                    logger.warning(f"Analytics flush to {table} -> {r.status_code}: {r.text[:200]}")
+                    failed += events
+
+            if rejected:
+                self._dead_letter(rejected)
+            # Неотправленное возвращаем в буфер и в текущий spool до следующей попытки
+            for event in failed:
+                self._add(event, wakeup=False)
+            self._failures = self._failures + 1 if failed else 0
+            if os.path.exists(self._flushing_path):
+                os.remove(self._flushing_path)
+            logger.debug(f"Analytics flushed: {sum(len(b) for _, b, _ in batches) - len(failed) - len(rejected)} rows, "
+                         f"{len(failed)} deferred, {len(rejected)} rejected")
+
+    # --- SPOOL ---
+    @property
+    def _flushing_path(self) -> str:
+        return self.spool_path + ".flushing"
+
+    def _dead_letter(self, events: list):
+        """Отвергнутые строки — в отдельный файл для ручного разбора, на старте не перечитываются."""
+        try:
+            with open(self.spool_path + ".rejected", "a", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not save {len(events)} rejected analytics rows: {e!r}")
+
+    def _open_spool(self):
+        self._spool = open(self.spool_path, "a", buffering=1, encoding="utf-8")
+
+    def _rotate_spool(self):
+        if self._spool is None:
+            return
+        self._spool.close()
+        os.replace(self.spool_path, self._flushing_path)
+        self._open_spool()
+
+    def _load(self, path: str) -> list:
+        if not os.path.exists(path):
+            return []
+        events = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # недописанная строка после падения
+                if "t" in event and "row" in event:
+                    events.append(event)
+        os.remove(path)
+        return events
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
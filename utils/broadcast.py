@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from telegram.error import BadRequest, Forbidden
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcast:
+    """Рассылка по всем пользователям из таблицы users без загрузки списка целиком.
+
+    Получатели читаются страницами по ключу chat_id (chat_id > последний), отправка идёт
+    пачками по concurrency сообщений через фоновую полосу SendScheduler. После каждой
+    пачки прогресс пишется в файл: после падения рассылка продолжается с того же места,
+    а повторно уходит максимум одна пачка. Заблокировавшие бота удаляются из users
+    (при следующем /start запись появится снова).
+    """
+
+    def __init__(self, supabase, checkpoint_path: str, page_size: int = 1000, concurrency: int = 20,
+                 active_days: int = None, progress_interval: float = 30):
+        self.supabase = supabase
+        self.checkpoint_path = checkpoint_path
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.active_days = active_days
+        self.progress_interval = progress_interval
+        self.state = self._load()
+        self._lock = asyncio.Lock()
+        self._started = None
+        self._done_at_start = 0
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def unfinished(self):
+        """Чекпоинт прерванной рассылки или None."""
+        return self.state if self.state and not self.state.get("done") else None
+
+    async def run(self, name: str, payload: dict, send):
+        """send(chat_id, payload) отправляет одно сообщение. Повторный run с тем же name
+        продолжает прерванную рассылку, а завершённую не повторяет."""
+        async with self._lock:
+            if self.state and self.state["name"] == name:
+                if self.state.get("done"):
+                    logger.info(f"Broadcast {name} already finished, skipping")
+                    return self.state
+                logger.info(f"Resuming broadcast {name} after chat {self.state['last_chat_id']}")
+            else:
+                self.state = {
+                    "name": name, "payload": payload, "last_chat_id": 0, "since": self._since(),
+                    "total": None, "sent": 0, "blocked": 0, "failed": 0, "done": False,
+                }
+                self.state["total"] = await self._count()
+            self._started = time.monotonic()
+            self._done_at_start = self._processed()
+            last_report = self._started
+            try:
+                async for page in self._pages():
+                    for i in range(0, len(page), self.concurrency):
+                        await self._send_chunk(page[i:i + self.concurrency], send)
+                        if time.monotonic() - last_report >= self.progress_interval:
+                            last_report = time.monotonic()
+                            logger.info(f"Broadcast progress: {self.progress()}")
+            except Exception:
+                logger.exception(f"Broadcast {name} interrupted at chat {self.state['last_chat_id']}")
+                raise
+            self.state["done"] = True
+            self.state["finished_at"] = datetime.now(timezone.utc).isoformat()
+            self._save()
+            logger.info(f"Broadcast finished: {self.progress()}")
+            return self.state
+
+    async def _pages(self):
+        while True:
+            params = {
+                "select": "chat_id", "order": "chat_id.asc", "limit": str(self.page_size),
+                "chat_id": f"gt.{self.state['last_chat_id']}",
+            }
+            if self.state.get("since"):
+                params["latest_interaction"] = f"gte.{self.state['since']}"
+            r = await self.supabase.request("GET", "users", params=params)
+            if r.status_code != 200:
+                raise RuntimeError(f"users page -> {r.status_code}: {r.text[:200]}")
+            page = [row["chat_id"] for row in r.json()]
+            if not page:
+                return
+            yield page
+            if len(page) < self.page_size:
+                return
+
+    async def _send_chunk(self, chat_ids, send):
+        payload = self.state["payload"]
+        results = await asyncio.gather(*(send(chat_id, payload) for chat_id in chat_ids), return_exceptions=True)
+        blocked = []
+        for chat_id, result in zip(chat_ids, results):
+            if not isinstance(result, Exception):
+                self.state["sent"] += 1
+            elif isinstance(result, Forbidden) or (
+                    isinstance(result, BadRequest) and "chat not found" in result.message.lower()):
+                blocked.append(chat_id)
+            else:
+                self.state["failed"] += 1
+                logger.warning(f"Broadcast to {chat_id} failed: {result!r}")
+        if blocked:
+            await self._prune(blocked)
+        self.state["last_chat_id"] = chat_ids[-1]
+        self._save()
+
+    async def _prune(self, chat_ids):
+        self.state["blocked"] += len(chat_ids)
+        try:
+            r = await self.supabase.delete("users", {"chat_id": f"in.({','.join(map(str, chat_ids))})"})
+        except Exception as e:
+            logger.warning(f"Failed to prune {len(chat_ids)} blocked users: {e!r}")
+            return
+        if r.status_code >= 300:
+            logger.warning(f"Failed to prune {len(chat_ids)} blocked users -> {r.status_code}: {r.text[:200]}")
+
+    async def _count(self):
+        params = {"chat_id": "gt.0"}
+        if self.state.get("since"):
+            params["latest_interaction"] = f"gte.{self.state['since']}"
+        try:
+            return await self.supabase.count("users", params)
+        except Exception as e:
+            logger.warning(f"Failed to count broadcast recipients: {e!r}")
+            return None
+
+    def _since(self):
+        if not self.active_days:
+            return None
+        return (datetime.now(timezone.utc) - timedelta(days=self.active_days)).isoformat()
+
+    # --- ПРОГРЕСС ---
+    def _processed(self) -> int:
+        return self.state["sent"] + self.state["blocked"] + self.state["failed"]
+
+    def progress(self) -> dict:
+        if not self.state:
+            return {}
+        done = self._processed()
+        elapsed = time.monotonic() - self._started if self._started and self.running else None
+        rate = (done - self._done_at_start) / elapsed if elapsed else None
+        total = self.state["total"]
+        eta = (total - done) / rate if rate and total and total > done else None
+        return {
+            "name": self.state["name"], "running": self.running, "done": self.state.get("done", False),
+            "total": total, "sent": self.state["sent"], "blocked": self.state["blocked"],
+            "failed": self.state["failed"], "rate": round(rate, 1) if rate else None,
+            "eta_s": round(eta) if eta is not None else None,
+        }
+
+    def describe(self) -> str:
+        p = self.progress()
+        if not p:
+            return "Рассылок ещё не было"
+        status = "идёт" if p["running"] else "завершена" if p["done"] else "прервана"
+        line = (f"Рассылка {p['name']} {status}: отправлено {p['sent']} из {p['total'] or '?'}, "
+                f"заблокировали {p['blocked']}, ошибок {p['failed']}")
+        if p["rate"]:
+            line += f", {p['rate']} сообщ./с"
+        if p["eta_s"] is not None:
+            line += f", осталось ~{p['eta_s'] // 60} мин"
+        return line
+
+    # --- ЧЕКПОИНТ ---
+    def _load(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.checkpoint_path)
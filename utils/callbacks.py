@@ -0,0 +1,95 @@
+import logging
+
+from telegram.ext import CallbackQueryHandler
+
+VERSION = "1"
+SEP = ":"
+MAX_BYTES = 64  # лимит Telegram на callback_data
+
+logger = logging.getLogger(__name__)
+
+
+def opt_int(value: str):
+    """Число или None, закодированный пустой строкой (например, серия «микс»)."""
+    return int(value) if value else None
+
+
+class CallbackRouter:
+    """Компактный протокол callback_data и один диспетчер вместо цепочки regex-обработчиков.
+
+    Формат: '<версия><код>[:арг:арг...]', например '1a:17:23'. Данные разбираются один раз
+    по таблице кодов, обработчик получает уже типизированные аргументы:
+    handler(update, context, *args). Кнопки прошлых версий протокола и неизвестные
+    коды уходят в fallback.
+    """
+
+    def __init__(self, version: str = VERSION):
+        self.version = version
+        self.codes = {}     # action -> code
+        self.actions = {}   # code -> (action, типы аргументов)
+        self.handlers = {}  # action -> callback
+        self.fallback = None
+
+    def action(self, name: str, code: str, *types):
+        if SEP in code or code in self.actions:
+            raise ValueError(f"bad or duplicate callback code {code!r}")
+        self.codes[name] = code
+        self.actions[code] = (name, types)
+
+    def route(self, name: str, callback):
+        if name not in self.codes:
+            raise KeyError(name)
+        self.handlers[name] = callback
+
+    def encode(self, name: str, *args) -> str:
+        data = self.version + self.codes[name]
+        if args:
+            data += SEP + SEP.join("" if a is None else str(a) for a in args)
+        if len(data.encode()) > MAX_BYTES:
+            raise ValueError(f"callback_data too long: {data!r}")
+        return data
+
+    def decode(self, data):
+        """(action, args) или None для чужих и устаревших данных."""
+        if not isinstance(data, str) or not data.startswith(self.version):
+            return None
+        code, *raw = data[len(self.version):].split(SEP)
+        entry = self.actions.get(code)
+        if entry is None:
+            return None
+        name, types = entry
+        if len(raw) != len(types):
+            return None
+        try:
+            return name, tuple(t(v) for t, v in zip(types, raw))
+        except ValueError:
+            return None
+
+    async def dispatch(self, update, context):
+        decoded = self.decode(update.callback_query.data)
+        callback = decoded and self.handlers.get(decoded[0])
+        if callback is None:
+            logger.info(f"Stale callback_data {update.callback_query.data!r}")
+            if self.fallback is not None:
+                return await self.fallback(update, context)
+            return await update.callback_query.answer()
+        return await callback(update, context, *decoded[1])
+
+    def dispatcher(self) -> CallbackQueryHandler:
+        """Один обработчик на все кнопки; регистрировать после диалогов."""
+        return CallbackQueryHandler(self.dispatch)
+
+    def handler(self, name: str, callback) -> CallbackQueryHandler:
+        """Отдельный обработчик одного действия, например для entry_points диалога."""
+        prefix = self.version + self.codes[name]
+
+        async def routed(update, context):
+            decoded = self.decode(update.callback_query.data)
+            if decoded is None:
+                return await self.dispatch(update, context)
+            return await callback(update, context, *decoded[1])
+
+        routed.__name__ = callback.__name__
+        return CallbackQueryHandler(
+            routed, pattern=lambda data: isinstance(data, str) and (data == prefix or data.startswith(prefix + SEP))
+        )
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+
+from utils import snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class AsanaCatalog:
+    """Весь справочник асан в памяти: грузится при старте и обновляется в фоне."""
+
+    def __init__(self, loader, ttl: int = 3600, retry: int = 30, snapshot_path: str = None):
+        self._loader = loader
+        self.snapshot_path = snapshot_path
+        self.digest = None
+        self.ttl = ttl
+        self.retry = retry
+        self.version = 0
+        self.loaded_at = None
+        self.rows = ()
+        self._by_id = {}
+        self._by_series = {}
+        self._by_order = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def refresh(self) -> bool:
+        async with self._lock:
+            try:
+                rows = await self._loader()
+            except Exception as e:
+                logger.warning(f"Catalog refresh failed: {e}")
+                return False
+            if not rows:
+                logger.warning("Catalog refresh returned no rows, keeping current data")
+                return False
+            digest = snapshot.digest(rows)
+            if digest != self.digest:
+                self._build(rows)
+                self.digest = digest
+                logger.info(f"Catalog v{self.version} loaded: {len(self.rows)} asanas")
+                if self.snapshot_path:
+                    snapshot.save(self.snapshot_path, rows)
+            self.loaded_at = time.monotonic()
+            return True
+
+    def load_snapshot(self, *paths) -> bool:
+        """Поднять каталог из первого найденного снимка, без сети."""
+        for path in paths:
+            rows = snapshot.load(path) if path else None
+            if rows:
+                self._build(rows)
+                self.digest = snapshot.digest(rows)
+                self.loaded_at = None  # данные со снимка, обновим из Supabase в фоне
+                logger.info(f"Catalog v{self.version} loaded from snapshot {path}: {len(self.rows)} asanas")
+                return True
+        return False
+
+    def _build(self, rows):
+        rows = tuple(sorted(rows, key=lambda a: (a['series'], a['order_num'])))
+        by_series = {}
+        for a in rows:
+            by_series.setdefault(a['series'], []).append(a)
+        # Индексы подменяются целиком, чтобы обработчики не видели наполовину собранный каталог
+        self._by_id = {a['id']: a for a in rows}
+        self._by_series = by_series
+        self._by_order = {(a['series'], a['order_num']): a for a in rows}
+        self.rows = rows
+        self.version += 1
+        self.loaded_at = time.monotonic()
+
+    def get(self, aid: int):
+        return self._by_id.get(aid)
+
+    def series(self, series: int = None):
+        if series is None:
+            return list(self.rows)
+        return self._by_series.get(series, [])
+
+    @property
+    def by_series(self) -> dict:
+        return self._by_series
+
+    def by_order(self, series: int, order_num: int):
+        return self._by_order.get((series, order_num))
+
+    def range(self, series: int, start: int, end: int):
+        found = (self._by_order.get((series, n)) for n in range(start, end + 1))
+        return [a for a in found if a]
+
+    # --- ФОНОВОЕ ОБНОВЛЕНИЕ ---
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl if self.loaded_at is not None else self.retry)
+            await self.refresh()
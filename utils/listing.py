@@ -0,0 +1,46 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+class SeriesListing:
+    """Готовые клавиатуры «Посмотреть асаны» по страницам, собранные один раз на версию каталога.
+
+    InlineKeyboardMarkup в PTB неизменяемы, поэтому одни и те же объекты
+    отдаются всем пользователям.
+    """
+
+    def __init__(self, catalog, encode, page_size: int = 10):
+        self.catalog = catalog
+        self.encode = encode  # CallbackRouter.encode
+        self.page_size = page_size
+        self._version = None
+        self._pages = {}  # series -> (InlineKeyboardMarkup, ...)
+
+    def _ensure(self):
+        if self._version == self.catalog.version:
+            return
+        self._pages = {series: self._build(series, rows) for series, rows in self.catalog.by_series.items()}
+        self._version = self.catalog.version
+
+    def _build(self, series: int, rows) -> tuple:
+        cb, size = self.encode, self.page_size
+        pages = []
+        for offset in range(0, len(rows), size):
+            kb = [[InlineKeyboardButton(f"{a['order_num']}. {a['name']}", callback_data=cb('info', a['id']))]
+                  for a in rows[offset:offset + size]]
+            nav = []
+            if offset > 0:
+                nav.append(InlineKeyboardButton("◀️", callback_data=cb('view_all', series, offset - size)))
+            if offset + size < len(rows):
+                nav.append(InlineKeyboardButton("▶️", callback_data=cb('view_all', series, offset + size)))
+            kb.append(nav)
+            kb.append([InlineKeyboardButton("🏠 Меню", callback_data=cb('to_start'))])
+            pages.append(InlineKeyboardMarkup(kb))
+        return tuple(pages)
+
+    def page(self, series: int, offset: int = 0):
+        """Клавиатура страницы, на которую попадает offset; None, если серии нет в каталоге."""
+        self._ensure()
+        pages = self._pages.get(series)
+        if not pages:
+            return None
+        return pages[min(max(offset, 0) // self.page_size, len(pages) - 1)]
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """URL картинки/видео -> file_id из Telegram, чтобы каждый файл загружался только один раз."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ids = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self._ids = json.load(f)
+            except ValueError:
+                logger.warning(f"Media cache {path} is corrupted, starting empty")
+
+    def get(self, url: str):
+        return self._ids.get(url)
+
+    def media(self, url: str) -> str:
+        return self._ids.get(url, url)
+
+    def remember(self, url: str, message):
+        file_id = _file_id(message)
+        if file_id and self._ids.get(url) != file_id:
+            self._ids[url] = file_id
+            self._save()
+
+    def forget(self, url: str):
+        if self._ids.pop(url, None):
+            self._save()
+
+    async def send(self, send_fn, url: str, **kwargs):
+        """send_fn(media, **kwargs): reply_photo, reply_video, partial(bot.send_photo, chat_id)..."""
+        file_id = self._ids.get(url)
+        if file_id:
+            try:
+                return await send_fn(file_id, **kwargs)
+            except BadRequest as e:
+                if "file" not in e.message.lower():
+                    raise
+                logger.info(f"Cached file_id for {url} rejected ({e.message}), re-sending by URL")
+                self.forget(url)
+        message = await send_fn(url, **kwargs)
+        self.remember(url, message)
+        return message
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._ids, f)
+        os.replace(tmp, self.path)
+
+
+def _file_id(message):
+    if message is None:
+        return None
+    if message.photo:
+        return message.photo[-1].file_id
+    media = message.video or message.animation or message.document
+    return media.file_id if media else None
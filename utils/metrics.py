@@ -0,0 +1,189 @@
+import contextvars
+import cProfile
+import functools
+import heapq
+import io
+import itertools
+import pstats
+import random
+import time
+
+from telegram.ext import ConversationHandler
+
+from utils.callbacks import CallbackRouter
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 20)  # для количеств, а не секунд
+
+_trace = contextvars.ContextVar("update_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Счётчики и гистограммы в памяти процесса плюс текстовый формат Prometheus для /metrics."""
+
+    def __init__(self, slow_keep: int = 20, profile_rate: float = 0.0):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> float
+        self.gauges = {}      # name -> callable, возвращающий число или {labels: число}
+        self.slow_keep = slow_keep
+        self.profile_rate = profile_rate
+        self._slow = []  # min-heap (duration, seq, trace)
+        self._seq = itertools.count()
+        self._profiling = False
+
+    def observe(self, name: str, value: float, buckets=BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram(buckets)
+        hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, fn):
+        self.gauges[name] = fn
+
+    # --- ВНЕШНИЕ ВЫЗОВЫ ---
+    def external_call(self, service: str, name: str, seconds: float, error: bool = False):
+        self.observe("bot_external_call_seconds", seconds, service=service, call=name)
+        self.inc("bot_external_calls_total", service=service, call=name)
+        if error:
+            self.inc("bot_external_call_errors_total", service=service, call=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace["calls"].append((service, name, round(seconds * 1000, 2)))
+
+    # --- ОБРАБОТЧИКИ ---
+    def wrap(self, name: str, callback):
+        @functools.wraps(callback)
+        async def timed(update, context, *args, **kwargs):
+            if _trace.get() is not None:  # вложенный обработчик того же апдейта
+                return await callback(update, context, *args, **kwargs)
+            trace = {"handler": name, "calls": []}
+            token = _trace.set(trace)
+            profiler = self._start_profile()
+            started = time.perf_counter()
+            error = False
+            try:
+                return await callback(update, context, *args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                _trace.reset(token)
+                self.observe("bot_handler_seconds", elapsed, handler=name)
+                self.inc("bot_handler_calls_total", handler=name)
+                if error:
+                    self.inc("bot_handler_errors_total", handler=name)
+                for service in {c[0] for c in trace["calls"]}:
+                    self.observe("bot_update_external_calls", sum(1 for c in trace["calls"] if c[0] == service),
+                                 buckets=COUNT_BUCKETS, service=service)
+                if profiler:
+                    trace["profile"] = self._stop_profile(profiler)
+                self._remember_slow(elapsed, trace)
+        return timed
+
+    def instrument(self, app):
+        """Оборачивает callback каждого зарегистрированного обработчика, включая состояния диалогов."""
+        for handlers in app.handlers.values():
+            for handler in handlers:
+                self._instrument_handler(handler)
+
+    def _instrument_handler(self, handler):
+        if isinstance(handler, ConversationHandler):
+            inner = list(handler.entry_points) + list(handler.fallbacks)
+            inner += [h for state in handler.states.values() for h in state]
+            for h in inner:
+                self._instrument_handler(h)
+        elif isinstance(getattr(handler.callback, "__self__", None), CallbackRouter):
+            # Время считаем по действиям роутера, а не по общему dispatch
+            router = handler.callback.__self__
+            for name, callback in router.handlers.items():
+                if getattr(callback, "__wrapped__", None) is None:
+                    router.handlers[name] = self.wrap(callback.__name__, callback)
+            if router.fallback is not None and getattr(router.fallback, "__wrapped__", None) is None:
+                router.fallback = self.wrap(router.fallback.__name__, router.fallback)
+        elif getattr(handler.callback, "__wrapped__", None) is None:
+            handler.callback = self.wrap(handler.callback.__name__, handler.callback)
+
+    # --- МЕДЛЕННЫЕ АПДЕЙТЫ ---
+    def _remember_slow(self, elapsed: float, trace: dict):
+        trace["ms"] = round(elapsed * 1000, 2)
+        item = (elapsed, next(self._seq), trace)
+        if len(self._slow) < self.slow_keep:
+            heapq.heappush(self._slow, item)
+        elif elapsed > self._slow[0][0]:
+            heapq.heapreplace(self._slow, item)
+
+    def slowest(self) -> list:
+        return [trace for _, _, trace in sorted(self._slow, reverse=True)]
+
+    def _start_profile(self):
+        if self._profiling or not self.profile_rate or random.random() >= self.profile_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # другой профайлер уже активен
+            return None
+        self._profiling = True
+        return profiler
+
+    def _stop_profile(self, profiler) -> str:
+        profiler.disable()
+        self._profiling = False
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+        return out.getvalue()
+
+    # --- ЭКСПОРТ ---
+    def render(self) -> str:
+        lines = []
+        for (name, labels), hist in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for name, fn in sorted(self.gauges.items()):
+            value = fn()
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    lines.append(f"{name}{_labels(labels)} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+metrics = Metrics()
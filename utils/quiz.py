@@ -0,0 +1,81 @@
+import random
+from array import array
+
+
+class QuizBuilder:
+    """Готовит тест целиком: вопросы и варианты ответов из заранее построенных индексов.
+
+    Индексы пересобираются только при смене версии каталога. Вопрос хранится
+    как [правильный id, вариант, вариант, вариант] в порядке показа.
+
+    С seed у каждого теста свой генератор от (seed, uid, номер теста пользователя):
+    порядок, в котором параллельные апдейты обращаются к генератору, на тесты не влияет.
+    """
+
+    def __init__(self, catalog, seed: int = None, hard: bool = False, options: int = 3):
+        self.catalog = catalog
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self._drawn = {}  # uid -> сколько тестов уже собрано, только при seed
+        self.hard = hard
+        self.options = options
+        self._version = None
+        self._pools = {}      # series (None = микс) -> array id
+        self._neighbours = {}  # id -> похожие асаны той же серии
+
+    def _ensure(self):
+        if self._version == self.catalog.version:
+            return
+        pools = {None: array('I', (a['id'] for a in self.catalog.rows))}
+        families = {}
+        neighbours = {}
+        for series, rows in self.catalog.by_series.items():
+            pools[series] = array('I', (a['id'] for a in rows))
+            for i, a in enumerate(rows):
+                # Соседи по порядку в серии (Прасарита A-D и т.п.) и асаны с тем же первым словом
+                near = {rows[j]['id'] for j in (i - 1, i + 1) if 0 <= j < len(rows)}
+                neighbours[a['id']] = near
+                words = (a.get('name') or '').lower().split()
+                if len(words) > 1:
+                    families.setdefault((series, words[0]), []).append(a['id'])
+        for family in families.values():
+            for aid in family:
+                neighbours[aid].update(x for x in family if x != aid)
+        self._pools = pools
+        self._neighbours = {aid: tuple(near) for aid, near in neighbours.items()}
+        self._version = self.catalog.version
+
+    def make_test(self, series: int = None, n: int = 10, uid: int = None) -> list:
+        self._ensure()
+        rng = self._rng(uid)
+        pool = self._pools.get(series, ())
+        ids = rng.sample(pool, min(n, len(pool)))
+        return self._build(ids, pool, rng)
+
+    def questions(self, ids, series: int = None, uid: int = None) -> list:
+        self._ensure()
+        return self._build(ids, self._pools.get(series, ()), self._rng(uid))
+
+    def _rng(self, uid):
+        if self.seed is None:
+            return self.rng
+        n = self._drawn[uid] = self._drawn.get(uid, 0) + 1
+        return random.Random(f"{self.seed}:{uid}:{n}")
+
+    def _build(self, ids, pool, rng) -> list:
+        return [self._question(aid, pool, rng) for aid in ids]
+
+    def _question(self, aid: int, pool, rng) -> list:
+        want = min(self.options - 1, len(pool) - 1)
+        picked = []
+        if self.hard:
+            near = [x for x in self._neighbours.get(aid, ()) if x in pool]
+            picked = rng.sample(near, min(want, len(near)))
+        # Случайные индексы с отбраковкой повторов: без копирования пула на каждый вопрос
+        while len(picked) < want:
+            x = pool[rng.randrange(len(pool))]
+            if x != aid and x not in picked:
+                picked.append(x)
+        options = picked + [aid]
+        rng.shuffle(options)
+        return [aid] + options
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"  # bot.send_*(..., rate_limit_args=BACKGROUND) для рассылок и прогрева
+
+
+class TokenBucket:
+    """Бакет с резервированием: take() сразу списывает токен (можно в долг) и говорит, сколько ждать."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill(time.monotonic())
+        return self.tokens
+
+    def take(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, seconds: float):
+        self._refill(time.monotonic())
+        # Следующий take() будет ждать ровно seconds (плюс уже стоящие в очереди)
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+
+class SendScheduler(BaseRateLimiter):
+    """Все запросы к Bot API: общий лимит бота, лимит на чат и приоритет интерактива над фоном.
+
+    Интерактивные ответы резервируют токены сразу. Фоновые ждут, пока в общем бакете
+    не появится свободный токен сверх резерва под интерактив. На RetryAfter чат (или весь бот, если чата нет)
+    замораживается на указанное время, и запрос повторяется.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 5,
+                 group_rate: float = 20 / 60, group_burst: float = 3, max_retries: int = 3,
+                 background_headroom: float = 0.2):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        # Часть общего бакета фон не трогает никогда: она остаётся под всплеск интерактива.
+        # Резерв меньше ёмкости бакета (= global_rate), иначе при низком лимите фон не уйдёт никогда
+        self.background_reserve = max(0.0, min(1 + global_rate * background_headroom, global_rate - 1))
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self.waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.sent = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.wait_total = {INTERACTIVE: 0.0, BACKGROUND: 0.0}
+        self.wait_max = {INTERACTIVE: 0.0, BACKGROUND: 0.0}
+        self.retry_after_count = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": dict(self.waiting),
+            "sent": dict(self.sent),
+            "wait_avg": {lane: self.wait_total[lane] / self.sent[lane] if self.sent[lane] else 0.0 for lane in self.sent},
+            "wait_max": dict(self.wait_max),
+            "retry_after": self.retry_after_count,
+            "chat_buckets": len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Полные бакеты ничего не помнят, их можно выбросить
+                self._chats = {k: b for k, b in self._chats.items() if b.available() < b.burst}
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = (
+                TokenBucket(self.group_rate, self.group_burst) if group else TokenBucket(self.chat_rate, self.chat_burst)
+            )
+        return bucket
+
+    async def _acquire(self, chat_id, lane: str):
+        started = time.monotonic()
+        self.waiting[lane] += 1
+        try:
+            if chat_id is not None:
+                delay = self._chat_bucket(chat_id).take()
+                if delay:
+                    await asyncio.sleep(delay)
+            if lane == BACKGROUND:
+                # Интерактивные запросы уходят в долг сразу, поэтому фон ждёт, пока долг не погашен
+                while self._global.available() < self.background_reserve:
+                    await asyncio.sleep(1 / self.global_rate)
+            delay = self._global.take()
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.waiting[lane] -= 1
+        waited = time.monotonic() - started
+        metrics.observe("bot_send_wait_seconds", waited, lane=lane)
+        self.sent[lane] += 1
+        self.wait_total[lane] += waited
+        self.wait_max[lane] = max(self.wait_max[lane], waited)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        lane = BACKGROUND if rate_limit_args == BACKGROUND else INTERACTIVE
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, lane)
+            started = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                metrics.external_call("telegram", endpoint, time.perf_counter() - started, error=True)
+                self.retry_after_count += 1
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logger.warning(f"{endpoint} to {chat_id} hit flood control, retrying in {retry_after}s")
+                (self._chat_bucket(chat_id) if chat_id is not None else self._global).block(retry_after)
+                continue
+            except Exception:
+                metrics.external_call("telegram", endpoint, time.perf_counter() - started, error=True)
+                raise
+            metrics.external_call("telegram", endpoint, time.perf_counter() - started)
+            return result
@@ -0,0 +1,49 @@
+import logging
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+# Экран по нажатию кнопки: правим текущее сообщение, если тип совпадает,
+# и только при смене типа (текст <-> фото) или ошибке правки удаляем и шлём заново.
+async def show_text(query, text: str, **kwargs):
+    msg = query.message
+    if msg.text is not None:
+        try:
+            return await query.edit_message_text(text, **kwargs)
+        except BadRequest as e:
+            if _not_modified(e):
+                return msg
+            logger.info(f"edit_message_text failed ({e.message}), re-sending")
+    await _delete(msg)
+    return await msg.reply_text(text, **kwargs)
+
+
+async def show_photo(query, media, url: str, caption: str = None, parse_mode=None, reply_markup=None):
+    msg = query.message
+    if msg.photo:
+        def edit(photo):
+            return query.edit_message_media(
+                InputMediaPhoto(photo, caption=caption, parse_mode=parse_mode), reply_markup=reply_markup
+            )
+        try:
+            return await media.send(edit, url)
+        except BadRequest as e:
+            if _not_modified(e):
+                return msg
+            logger.info(f"edit_message_media failed ({e.message}), re-sending")
+    await _delete(msg)
+    return await media.send(msg.reply_photo, url, caption=caption, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
+async def _delete(msg):
+    try:
+        await msg.delete()
+    except BadRequest:
+        pass
+
+
+def _not_modified(e: BadRequest) -> bool:
+    return "not modified" in e.message.lower()
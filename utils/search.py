@@ -0,0 +1,77 @@
+import bisect
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r"[^\w]+")
+FIELDS = ("name", "transcription", "meaning")
+
+
+def normalize(text: str) -> str:
+    """Без регистра и диакритики: 'Бхуджапӣдāсана' -> 'бхуджапидасана', 'ё' -> 'е'."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", text.lower().replace("_", " ")).strip()
+
+
+def trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Поиск асаны по названию, транскрипции и значению для inline-режима.
+
+    Индекс пересобирается при смене версии каталога: отсортированный список слов для
+    поиска по префиксу (bisect) и триграммы для опечаток и вхождений в середине слова.
+    """
+
+    def __init__(self, catalog, min_similarity: float = 0.4):
+        self.catalog = catalog
+        self.min_similarity = min_similarity
+        self._version = None
+        self._words = []     # отсортированные (слово, id асаны)
+        self._trigrams = {}  # триграмма -> {id асаны}
+        self._rank = {}      # id асаны -> позиция в каталоге
+
+    def _ensure(self):
+        if self._version == self.catalog.version:
+            return
+        words, grams = set(), {}
+        for a in self.catalog.rows:
+            for field in FIELDS:
+                for word in normalize(a.get(field)).split():
+                    words.add((word, a['id']))
+                    for g in trigrams(word):
+                        grams.setdefault(g, set()).add(a['id'])
+        self._words = sorted(words)
+        self._trigrams = grams
+        self._rank = {a['id']: i for i, a in enumerate(self.catalog.rows)}
+        self._version = self.catalog.version
+
+    def _prefixed(self, prefix: str) -> set:
+        i = bisect.bisect_left(self._words, (prefix,))
+        found = set()
+        while i < len(self._words) and self._words[i][0].startswith(prefix):
+            found.add(self._words[i][1])
+            i += 1
+        return found
+
+    def find(self, query: str, limit: int = 20) -> list:
+        """id асан: сначала совпавшие по началу всех слов запроса, потом похожие по триграммам."""
+        self._ensure()
+        words = normalize(query).split()
+        if not words:
+            return []
+        exact = set.intersection(*(self._prefixed(w) for w in words))
+        found = sorted(exact, key=self._rank.get)
+        if len(found) < limit:
+            query_grams = set().union(*(trigrams(w) for w in words))
+            scores = {}
+            for g in query_grams:
+                for aid in self._trigrams.get(g, ()):
+                    scores[aid] = scores.get(aid, 0) + 1
+            threshold = self.min_similarity * len(query_grams)
+            fuzzy = [aid for aid, score in scores.items() if score >= threshold and aid not in exact]
+            fuzzy.sort(key=lambda aid: (-scores[aid], self._rank[aid]))
+            found += fuzzy
+        return found[:limit]
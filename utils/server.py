@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import signal
+from collections import deque, namedtuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Request = namedtuple("Request", "method path headers body")
+
+MAX_BODY = 1 << 20
+MAX_HEADERS = 100
+
+
+class KeyedLocks:
+    """asyncio.Lock на ключ (чат), который удаляется, как только его никто не ждёт."""
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, число ожидающих]
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных чатов, но строго по порядку внутри одного чата.
+
+    PTB держит слот семафора всё время do_process_update, поэтому апдейты занятого чата
+    не ждут здесь, а встают в очередь этого чата и сразу отдают слот. Очередь разбирает
+    тот, кто обрабатывает чат сейчас, так что один чат занимает не больше одного слота
+    и не может выбрать весь лимит CONCURRENT_UPDATES.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._queues = {}  # chat_id -> deque корутин, ждущих своей очереди
+
+    async def do_process_update(self, update, coroutine):
+        key = _chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        queue = self._queues[key] = deque()
+        try:
+            while coroutine is not None:
+                try:
+                    await coroutine
+                except Exception:
+                    logger.exception(f"Update processing failed for chat {key}")
+                coroutine = queue.popleft() if queue else None
+        finally:
+            del self._queues[key]
+            for pending in queue:  # отмена при остановке: не оставляем неожиданных корутин
+                pending.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def _chat_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.effective_user.id if update.effective_user else None
+
+
+class HttpServer:
+    """Минимальный HTTP/1.1 сервер на asyncio: вебхук, /health и служебные эндпоинты без лишних зависимостей.
+
+    Порт публичный, поэтому у запроса есть общий таймаут чтения, простаивающие
+    keep-alive соединения закрываются, а число соединений ограничено.
+    """
+
+    def __init__(self, host: str, port: int, read_timeout: float = 10.0, idle_timeout: float = 60.0,
+                 max_connections: int = 256):
+        self.host = host
+        self.port = port
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.routes = {}
+        self._server = None
+        self._connections = 0
+
+    def route(self, method: str, path: str, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        self._connections += 1
+        try:
+            if self._connections > self.max_connections:
+                await self._respond(writer, 503, "text/plain", b"busy", keep_alive=False)
+                return
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                if not line:
+                    break
+                request = await asyncio.wait_for(self._read_request(line, reader), self.read_timeout)
+                if request is None:
+                    await self._respond(writer, 413, "text/plain", b"too large", keep_alive=False)
+                    break
+                headers = request.headers
+                handler = self.routes.get((request.method, request.path))
+                if handler is None:
+                    status, ctype, payload = 404, "text/plain", b"not found"
+                else:
+                    try:
+                        status, ctype, payload = await handler(request)
+                    except Exception:
+                        logger.exception(f"HTTP handler for {request.path} failed")
+                        status, ctype, payload = 500, "text/plain", b"error"
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, ctype, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            pass
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    @staticmethod
+    async def _read_request(line: bytes, reader):
+        """Request или None, если заголовки или тело больше лимитов."""
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                return None
+            k, v = h.decode("latin-1").split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY:
+            return None
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target.split("?", 1)[0], headers, body)
+
+    @staticmethod
+    async def _respond(writer, status: int, ctype: str, payload: bytes, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+            f"Content-Type: {ctype}\r\nContent-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+
+def json_response(data, status: int = 200):
+    return status, "application/json", json.dumps(data).encode()
+
+
+async def metrics_endpoint(request: Request):
+    return 200, "text/plain; version=0.0.4", metrics.render().encode()
+
+
+def require_token(handler, token: str):
+    """Служебный эндпоинт только с заголовком Authorization: Bearer <token>."""
+    expected = f"Bearer {token}"
+
+    async def handle(request: Request):
+        if not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+            return 401, "text/plain", b"unauthorized"
+        return await handler(request)
+    return handle
+
+
+def webhook_handler(app, secret_token: str):
+    async def handle(request: Request):
+        token = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token, secret_token):
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = Update.de_json(json.loads(request.body), app.bot)
+        except ValueError:
+            return 400, "text/plain", b"bad update"
+        await app.update_queue.put(update)
+        return 200, "text/plain", b"ok"
+    return handle
+
+
+async def serve_webhook(app, server: HttpServer, url_path: str, webhook_url: str, secret_token: str,
+                        max_connections: int = 40):
+    """Аналог Application.run_webhook на нашем HttpServer, чтобы рядом жили /health и другие маршруты.
+
+    Без webhook_url вебхук в Telegram не регистрируется: апдейты присылает роутер шардов.
+    """
+    server.route("POST", url_path, webhook_handler(app, secret_token))
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await server.start()
+        if webhook_url:
+            await app.bot.set_webhook(
+                webhook_url, secret_token=secret_token, max_connections=max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await app.start()
+        await wait_for_signal()
+    finally:
+        await server.stop()
+        if app.running:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+async def wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Сессии обучения/теста в памяти: LRU с лимитом по числу сессий и TTL простоя.
+
+    В сессиях лежат только id асан и счётчики, сами строки берутся из каталога.
+    Изменив сессию на месте, обработчик должен вызвать save(uid).
+    """
+
+    def __init__(self, kind: str, ttl: int = 86400, max_sessions: int = 10000):
+        self.kind = kind
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._cache = OrderedDict()  # uid -> [data, touched]
+
+    def get(self, uid: int):
+        entry = self._cache.get(uid)
+        if entry is None:
+            data, touched = self._load(uid)
+            if data is None:
+                return None
+            entry = self._remember(uid, data, touched)
+        if time.time() - entry[1] > self.ttl:
+            self.pop(uid)
+            return None
+        self._cache.move_to_end(uid)
+        return entry[0]
+
+    def set(self, uid: int, data: dict):
+        self._remember(uid, data, time.time())
+        self._persist(uid, data)
+
+    def save(self, uid: int):
+        entry = self._cache.get(uid)
+        if entry is not None:
+            entry[1] = time.time()
+            self._persist(uid, entry[0])
+
+    def pop(self, uid: int, default=None):
+        entry = self._cache.pop(uid, None)
+        self._delete(uid)
+        return entry[0] if entry else default
+
+    def evict_idle(self) -> int:
+        deadline = time.time() - self.ttl
+        stale = [uid for uid, (_, touched) in self._cache.items() if touched < deadline]
+        for uid in stale:
+            del self._cache[uid]
+        return len(stale) + self._delete_idle(deadline)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _remember(self, uid: int, data: dict, touched: float):
+        entry = self._cache[uid] = [data, touched]
+        self._cache.move_to_end(uid)
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+        return entry
+
+    # Хранилище в памяти ничего не сохраняет: при вытеснении сессия теряется
+    def _load(self, uid: int):
+        return None, 0
+
+    def _persist(self, uid: int, data: dict):
+        pass
+
+    def _delete(self, uid: int):
+        pass
+
+    def _delete_idle(self, deadline: float) -> int:
+        return 0
+
+
+class SqliteSessionStore(SessionStore):
+    """Та же LRU-память поверх SQLite: сессии переживают рестарт и вытеснение из кеша."""
+
+    def __init__(self, kind: str, conn: sqlite3.Connection, **kwargs):
+        super().__init__(kind, **kwargs)
+        self.conn = conn
+
+    def _load(self, uid: int):
+        row = self.conn.execute(
+            "SELECT data, touched FROM sessions WHERE kind = ? AND uid = ?", (self.kind, uid)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def _persist(self, uid: int, data: dict):
+        self.conn.execute(
+            "INSERT INTO sessions (kind, uid, data, touched) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (kind, uid) DO UPDATE SET data = excluded.data, touched = excluded.touched",
+            (self.kind, uid, json.dumps(data, separators=(",", ":")), time.time()),
+        )
+
+    def _delete(self, uid: int):
+        self.conn.execute("DELETE FROM sessions WHERE kind = ? AND uid = ?", (self.kind, uid))
+
+    def _delete_idle(self, deadline: float) -> int:
+        return self.conn.execute(
+            "DELETE FROM sessions WHERE kind = ? AND touched < ?", (self.kind, deadline)
+        ).rowcount
+
+
+def open_db(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        "kind TEXT NOT NULL, uid INTEGER NOT NULL, data TEXT NOT NULL, touched REAL NOT NULL, "
+        "PRIMARY KEY (kind, uid))"
+    )
+    return conn
+
+
+async def evict_loop(stores, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        evicted = sum(store.evict_idle() for store in stores)
+        if evicted:
+            logger.info(f"Evicted {evicted} idle sessions")
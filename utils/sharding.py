@@ -0,0 +1,158 @@
+"""Горизонтальное масштабирование: роутер перед воркерами, каждый воркер владеет своим шардом чатов.
+
+Telegram шлёт вебхук на роутер (ROLE=router), тот по chat_id выбирает узел на кольце
+консистентного хеширования и пересылает апдейт как есть на его WEBHOOK_PATH. Все апдейты
+одного чата попадают на один воркер (ROLE=worker) и обрабатываются там по порядку, так что
+сессии, диалоги и context.user_data остаются локальными. При добавлении узла переезжает
+только ~1/N чатов.
+
+Роутеру нужны WEBHOOK_URL и SHARD_NODES. Воркерам задаётся SHARD_COUNT (или тот же
+SHARD_NODES), чтобы общий лимит Bot API делился между ними.
+
+Что остаётся локальным для узла: рейтинг недели /top (см. utils/stats.py) и /refresh
+каталога, который обновляет только узел, обработавший команду.
+"""
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+import httpx
+from telegram import Bot, Update
+
+from utils.metrics import metrics
+from utils.server import (
+    HttpServer, KeyedLocks, Request, json_response, metrics_endpoint, require_token, wait_for_signal,
+)
+from utils.supabase import RETRY_STATUSES, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes, replicas: int = 100):
+        if not nodes:
+            raise ValueError("hash ring needs at least one node")
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._points = [p for p, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key) -> str:
+        i = bisect.bisect(self._points, _hash(str(key)))
+        return self._owners[i % len(self._owners)]
+
+
+def update_key(data: dict):
+    """Ключ шардирования из сырого JSON апдейта: чат, иначе пользователь (как у ChatOrderedProcessor)."""
+    for field, value in data.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if value.get("from"):
+            return value["from"]["id"]
+    return data.get("update_id")
+
+
+class ShardRouter:
+    """Пересылает апдейты владельцу шарда; апдейты одного чата уходят строго по очереди."""
+
+    def __init__(self, nodes, secret_token: str, url_path: str, replicas: int = 100,
+                 timeout: float = 10.0, retries: int = 2, backoff: float = 0.2, transport=None):
+        self.ring = HashRing(nodes, replicas)
+        self.secret_token = secret_token
+        self.url_path = url_path
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = httpx.Timeout(timeout)
+        self.transport = transport
+        self.forwarded = {node: 0 for node in self.ring.nodes}
+        self.failed = {node: 0 for node in self.ring.nodes}
+        self._locks = KeyedLocks()
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, transport=self.transport)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def handle(self, request: Request):
+        token = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token, self.secret_token):
+            return 403, "text/plain", b"forbidden"
+        try:
+            key = update_key(json.loads(request.body))
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return 400, "text/plain", b"bad update"
+        node = self.ring.node_for(key)
+        # Держим замок чата до ответа воркера: тот кладёт апдейт в очередь, и порядок сохраняется
+        async with self._locks.hold(key):
+            if await self._forward(node, request.body):
+                self.forwarded[node] += 1
+                return 200, "text/plain", b"ok"
+        self.failed[node] += 1
+        # Telegram повторит доставку позже, апдейт не теряется
+        return 503, "text/plain", b"shard unavailable"
+
+    async def _forward(self, node: str, body: bytes) -> bool:
+        headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret_token}
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                r = await self.client.post(node + self.url_path, content=body, headers=headers)
+            except httpx.TransportError as e:
+                metrics.external_call("shard", node, time.perf_counter() - started, error=True)
+                logger.warning(f"Forward to {node} failed: {e!r}")
+            else:
+                metrics.external_call("shard", node, time.perf_counter() - started, error=r.status_code >= 400)
+                if r.status_code == 200:
+                    return True
+                if r.status_code not in RETRY_STATUSES:
+                    logger.error(f"Shard {node} rejected update: {r.status_code}")
+                    return False
+                logger.warning(f"Shard {node} -> {r.status_code}")
+            if attempt < self.retries:
+                await asyncio.sleep(backoff_delay(self.backoff, attempt))
+        return False
+
+    async def health(self, request: Request):
+        return json_response({
+            "status": "ok",
+            "nodes": {node: {"forwarded": self.forwarded[node], "failed": self.failed[node]} for node in self.ring.nodes},
+            "chats_in_flight": len(self._locks),
+        })
+
+
+async def serve_router(router: ShardRouter, server: HttpServer, token: str, webhook_url: str,
+                       max_connections: int = 40, metrics_token: str = None):
+    server.route("POST", router.url_path, router.handle)
+    server.route("GET", "/health", router.health)
+    server.route("GET", "/metrics", require_token(metrics_endpoint, metrics_token or router.secret_token))
+    bot = Bot(token)
+    try:
+        await server.start()
+        async with bot:
+            await bot.set_webhook(
+                webhook_url, secret_token=router.secret_token, max_connections=max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        logger.info(f"Routing updates to {len(router.ring.nodes)} shards")
+        await wait_for_signal()
+    finally:
+        await server.stop()
+        await router.close()
@@ -0,0 +1,94 @@
+"""Локальный снимок каталога асан: бот стартует и отвечает без единого запроса в Supabase.
+
+Формат: JSON по колонкам с версией формата и хешем содержимого.
+
+    python -m utils.snapshot sync            # показать отличия от Supabase
+    python -m utils.snapshot sync --write    # и обновить файл снимка
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+FORMAT = 1
+COLUMNS = ("id", "series", "order_num", "name", "transcription", "meaning", "image_url")
+DEFAULT_PATH = "asanas.snapshot.json"
+
+
+def digest(rows) -> str:
+    canon = sorted(tuple(a.get(c) for c in COLUMNS) for a in rows)
+    return hashlib.sha256(json.dumps(canon, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def save(path: str, rows):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = {
+        "format": FORMAT,
+        "digest": digest(rows),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "columns": COLUMNS,
+        "rows": [[a.get(c) for c in COLUMNS] for a in sorted(rows, key=lambda a: (a['series'], a['order_num']))],
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load(path: str):
+    """Строки каталога из снимка или None, если файла нет или формат не наш."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("format") != FORMAT:
+        return None
+    columns = data["columns"]
+    return [dict(zip(columns, row)) for row in data["rows"]]
+
+
+def diff(old_rows, new_rows):
+    old = {a['id']: a for a in old_rows or ()}
+    new = {a['id']: a for a in new_rows}
+    added = sorted(new.keys() - old.keys())
+    removed = sorted(old.keys() - new.keys())
+    changed = sorted(
+        aid for aid in new.keys() & old.keys()
+        if any(old[aid].get(c) != new[aid].get(c) for c in COLUMNS)
+    )
+    return added, removed, changed
+
+
+async def sync(path: str, write: bool):
+    from dotenv import load_dotenv
+    from utils.supabase import Supabase
+
+    load_dotenv()
+    supabase = Supabase(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    try:
+        rows = await supabase.select("asanas", {"order": "order_num.asc"})
+    finally:
+        await supabase.close()
+    if not rows:
+        print("Supabase returned no asanas, snapshot left untouched")
+        return 1
+    current = load(path)
+    added, removed, changed = diff(current, rows)
+    print(f"{path}: {len(current or ())} asanas, Supabase: {len(rows)}")
+    print(f"added: {added}\nremoved: {removed}\nchanged: {changed}")
+    if write and (added or removed or changed or current is None):
+        save(path, rows)
+        print(f"snapshot written, digest {digest(rows)}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["sync"])
+    parser.add_argument("--path", default=os.getenv("CATALOG_SNAPSHOT", DEFAULT_PATH))
+    parser.add_argument("--write", action="store_true")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(sync(args.path, args.write)))
@@ -0,0 +1,122 @@
+import heapq
+import time
+from array import array
+from collections import OrderedDict
+
+MIN_EASE = 1.3
+START_EASE = 2.5
+RELEARN_DELAY = 60  # не вспомнил: покажем снова через минуту
+
+
+class UserCards:
+    """Состояние SM-2 по всем асанам пользователя в плоских массивах, индекс = id асаны."""
+
+    __slots__ = ("ease", "interval", "reps", "due", "queues")
+
+    def __init__(self):
+        self.ease = array('f')
+        self.interval = array('f')  # дни
+        self.reps = array('B')
+        self.due = array('I')       # unix time; 0 = карточка ещё не изучалась
+        self.queues = {}            # series -> heap [(due, aid)]
+
+    def ensure(self, aid: int):
+        missing = aid + 1 - len(self.due)
+        if missing > 0:
+            self.ease.extend([START_EASE] * missing)
+            self.interval.extend([0.0] * missing)
+            self.reps.extend([0] * missing)
+            self.due.extend([0] * missing)
+
+    def seen(self, aid: int) -> bool:
+        return aid < len(self.due) and self.due[aid] > 0
+
+
+class SrsEngine:
+    """Интервальное повторение (SM-2) с очередью на куче для каждой пары (пользователь, серия).
+
+    Следующая карточка выбирается за O(log n): устаревшие записи кучи отбрасываются
+    лениво. Каждая оценка сразу пишется одной строкой в SQLite, если он подключён.
+    """
+
+    def __init__(self, catalog, conn=None, max_users: int = 5000):
+        self.catalog = catalog
+        self.conn = conn
+        self.max_users = max_users
+        self._users = OrderedDict()
+        if conn is not None:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS srs_cards ("
+                "uid INTEGER NOT NULL, aid INTEGER NOT NULL, ease REAL NOT NULL, interval REAL NOT NULL, "
+                "reps INTEGER NOT NULL, due INTEGER NOT NULL, PRIMARY KEY (uid, aid))"
+            )
+
+    def _cards(self, uid: int) -> UserCards:
+        cards = self._users.get(uid)
+        if cards is None:
+            cards = UserCards()
+            if self.conn is not None:
+                rows = self.conn.execute(
+                    "SELECT aid, ease, interval, reps, due FROM srs_cards WHERE uid = ?", (uid,)
+                ).fetchall()
+                for aid, ease, interval, reps, due in rows:
+                    cards.ensure(aid)
+                    cards.ease[aid], cards.interval[aid], cards.reps[aid], cards.due[aid] = ease, interval, reps, due
+            self._users[uid] = cards
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(uid)
+        return cards
+
+    def _queue(self, cards: UserCards, series: int) -> list:
+        queue = cards.queues.get(series)
+        if queue is None:
+            queue = [(cards.due[a['id']], a['id']) for a in self.catalog.series(series) if cards.seen(a['id'])]
+            heapq.heapify(queue)
+            cards.queues[series] = queue
+        return queue
+
+    def next_card(self, uid: int, series: int, now: float = None):
+        """(id асаны, новая ли) или (None, ближайшее время повторения | None)."""
+        now = now or time.time()
+        cards = self._cards(uid)
+        queue = self._queue(cards, series)
+        while queue:
+            due, aid = queue[0]
+            if aid < len(cards.due) and cards.due[aid] == due and self.catalog.get(aid):
+                break
+            heapq.heappop(queue)  # запись устарела после новой оценки или асану убрали из каталога
+        if queue and queue[0][0] <= now:
+            return queue[0][1], False
+        for a in self.catalog.series(series):
+            if not cards.seen(a['id']):
+                return a['id'], True
+        return None, (queue[0][0] if queue else None)
+
+    def grade(self, uid: int, aid: int, quality: int, now: float = None):
+        """quality по SM-2: 0-2 не вспомнил, 3 с трудом, 4-5 уверенно."""
+        now = now or time.time()
+        cards = self._cards(uid)
+        cards.ensure(aid)
+        ease, interval, reps = cards.ease[aid], cards.interval[aid], cards.reps[aid]
+        if quality < 3:
+            reps, interval, due = 0, 0.0, now + RELEARN_DELAY
+        else:
+            interval = 1.0 if reps == 0 else 6.0 if reps == 1 else round(interval * ease, 1)
+            reps = min(reps + 1, 255)
+            due = now + interval * 86400
+            # Забытая карточка только переучивается, её лёгкость не меняется
+            ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        cards.ease[aid], cards.interval[aid], cards.reps[aid], cards.due[aid] = ease, interval, reps, int(due)
+
+        asana = self.catalog.get(aid)
+        if asana and asana['series'] in cards.queues:
+            heapq.heappush(cards.queues[asana['series']], (int(due), aid))
+        if self.conn is not None:
+            self.conn.execute(
+                "INSERT INTO srs_cards (uid, aid, ease, interval, reps, due) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (uid, aid) DO UPDATE SET ease = excluded.ease, interval = excluded.interval, "
+                "reps = excluded.reps, due = excluded.due",
+                (uid, aid, ease, interval, reps, int(due)),
+            )
+        return int(due)
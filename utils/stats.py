@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+MIN_QUESTIONS = 3  # асана считается «сложной» только после стольких вопросов о ней
+
+
+class UserStats:
+    __slots__ = ("name", "questions", "correct", "latency_ms", "streak", "best_streak",
+                 "tests", "best_score", "asanas")
+
+    def __init__(self):
+        self.name = None
+        self.questions = 0   # вопросы (первые попытки)
+        self.correct = 0     # верно с первой попытки
+        self.latency_ms = 0  # сумма по первым попыткам
+        self.streak = 0
+        self.best_streak = 0
+        self.tests = 0
+        self.best_score = 0
+        self.asanas = {}     # id асаны -> [вопросов, ошибок]
+
+    @property
+    def accuracy(self) -> float:
+        return self.correct / self.questions if self.questions else 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        return self.latency_ms / self.questions / 1000 if self.questions else 0.0
+
+
+class StatsEngine:
+    """Статистика ответов в тестах: сырые события пачками в SQLite, агрегаты в памяти.
+
+    Агрегаты по пользователю, по асане и рейтинг недели обновляются на каждом ответе,
+    поэтому /stats и /top не читают историю. На старте агрегаты восстанавливаются из
+    дневных сводок и ещё не свёрнутых событий; сырые события старше текущих суток
+    раз в час сворачиваются в answer_daily.
+
+    Всё хранится локально (память и sessions.db узла). При ROLE=worker у каждого узла
+    своя часть пользователей, поэтому /top показывает только лидеров шарда вызывающего:
+    общий рейтинг недели есть только при одном узле.
+    """
+
+    def __init__(self, catalog, conn=None, flush_interval: float = 5.0, max_batch: int = 500,
+                 compact_interval: float = 3600, top_size: int = 10):
+        self.catalog = catalog
+        self.conn = conn
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.compact_interval = compact_interval
+        self.top_size = top_size
+        self.users = {}    # uid -> UserStats
+        self.asanas = {}   # id асаны -> [вопросов, ошибок]
+        self.week = None
+        self.weekly = {}   # uid -> очки за неделю
+        self.top = []      # uid лидеров недели по убыванию очков
+        self._events = []
+        self._dirty = set()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        if conn is not None:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_events ("
+                "uid INTEGER NOT NULL, aid INTEGER NOT NULL, correct INTEGER NOT NULL, first INTEGER NOT NULL, "
+                "latency_ms INTEGER NOT NULL, ts REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_daily ("
+                "day TEXT NOT NULL, uid INTEGER NOT NULL, aid INTEGER NOT NULL, questions INTEGER NOT NULL, "
+                "correct INTEGER NOT NULL, latency_ms INTEGER NOT NULL, PRIMARY KEY (day, uid, aid))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats_users ("
+                "uid INTEGER PRIMARY KEY, name TEXT, streak INTEGER NOT NULL, best_streak INTEGER NOT NULL, "
+                "tests INTEGER NOT NULL, best_score INTEGER NOT NULL)"
+            )
+
+    # --- СОБЫТИЯ ---
+    def record_answer(self, uid: int, aid: int, correct: bool, latency: float, first: bool,
+                      name: str = None, now: float = None):
+        """Каждое нажатие на вариант; в агрегаты идут только первые попытки."""
+        now = now or time.time()
+        latency_ms = int(max(0.0, latency) * 1000)
+        self._events.append((uid, aid, int(correct), int(first), latency_ms, now))
+        u = self._user(uid, name)
+        if first:
+            u.questions += 1
+            u.latency_ms += latency_ms
+            per_user = u.asanas.setdefault(aid, [0, 0])
+            total = self.asanas.setdefault(aid, [0, 0])
+            per_user[0] += 1
+            total[0] += 1
+            if correct:
+                u.correct += 1
+                u.streak += 1
+                u.best_streak = max(u.best_streak, u.streak)
+                self._add_points(uid, now)
+            else:
+                u.streak = 0
+                per_user[1] += 1
+                total[1] += 1
+            self._dirty.add(uid)
+        if len(self._events) >= self.max_batch:
+            self._wakeup.set()
+
+    def record_test(self, uid: int, score: int):
+        u = self._user(uid)
+        u.tests += 1
+        u.best_score = max(u.best_score, score)
+        self._dirty.add(uid)
+
+    def _user(self, uid: int, name: str = None) -> UserStats:
+        u = self.users.get(uid)
+        if u is None:
+            u = self.users[uid] = UserStats()
+        if name and u.name != name:
+            u.name = name
+            self._dirty.add(uid)
+        return u
+
+    def _add_points(self, uid: int, now: float, points: int = 1):
+        week = _week(now)
+        if week != self.week:
+            self.week, self.weekly, self.top = week, {}, []
+        score = self.weekly[uid] = self.weekly.get(uid, 0) + points
+        # Очки за неделю только растут, поэтому топ поддерживается точно без пересчёта
+        if uid not in self.top:
+            if len(self.top) < self.top_size:
+                self.top.append(uid)
+            elif score > self.weekly[self.top[-1]]:
+                self.top[-1] = uid
+            else:
+                return
+        self.top.sort(key=lambda u: -self.weekly[u])
+
+    # --- ЗАПРОСЫ ---
+    def user(self, uid: int):
+        return self.users.get(uid)
+
+    def hardest(self, uid: int = None, n: int = 3) -> list:
+        """id асан с наибольшей долей ошибок: у пользователя или у всех."""
+        source = self.asanas if uid is None else getattr(self.users.get(uid), "asanas", {})
+        ranked = [(wrong / asked, aid) for aid, (asked, wrong) in source.items() if asked >= MIN_QUESTIONS and wrong]
+        return [aid for _, aid in sorted(ranked, reverse=True)[:n]]
+
+    def leaderboard(self, now: float = None) -> list:
+        """[(uid, имя, очки)] лидеров текущей недели."""
+        if _week(now or time.time()) != self.week:
+            return []
+        return [(uid, getattr(self.users.get(uid), "name", None), self.weekly[uid]) for uid in self.top]
+
+    def weekly_points(self, uid: int, now: float = None) -> int:
+        if _week(now or time.time()) != self.week:
+            return 0
+        return self.weekly.get(uid, 0)
+
+    def pending(self) -> int:
+        return len(self._events)
+
+    # --- ХРАНЕНИЕ ---
+    def load(self, now: float = None):
+        """Восстановить агрегаты из SQLite: один проход по сводкам и несвёрнутым событиям."""
+        if self.conn is None:
+            return
+        now = now or time.time()
+        for uid, name, streak, best_streak, tests, best_score in self.conn.execute("SELECT * FROM stats_users"):
+            u = self._user(uid)
+            u.name, u.streak, u.best_streak, u.tests, u.best_score = name, streak, best_streak, tests, best_score
+        rows = self.conn.execute(
+            "SELECT uid, aid, SUM(q), SUM(c), SUM(l) FROM ("
+            " SELECT uid, aid, questions AS q, correct AS c, latency_ms AS l FROM answer_daily"
+            " UNION ALL SELECT uid, aid, 1, correct, latency_ms FROM answer_events WHERE first = 1"
+            ") GROUP BY uid, aid"
+        )
+        for uid, aid, asked, correct, latency_ms in rows:
+            u = self._user(uid)
+            u.questions += asked
+            u.correct += correct
+            u.latency_ms += latency_ms
+            u.asanas[aid] = [asked, asked - correct]
+            total = self.asanas.setdefault(aid, [0, 0])
+            total[0] += asked
+            total[1] += asked - correct
+        start = _week_start(now)
+        rows = self.conn.execute(
+            "SELECT uid, SUM(c) FROM ("
+            " SELECT uid, correct AS c FROM answer_daily WHERE day >= ?"
+            " UNION ALL SELECT uid, correct FROM answer_events WHERE first = 1 AND ts >= ?"
+            ") GROUP BY uid",
+            (start.date().isoformat(), start.timestamp()),
+        )
+        self.week, self.weekly = _week(now), {uid: points for uid, points in rows if points}
+        self.top = sorted(self.weekly, key=lambda u: -self.weekly[u])[:self.top_size]
+        self._dirty.clear()
+        logger.info(f"Stats loaded: {len(self.users)} users, {sum(a[0] for a in self.asanas.values())} questions")
+
+    def flush(self):
+        if self.conn is None:
+            self._events.clear()
+            self._dirty.clear()
+            return
+        events, self._events = self._events, []
+        dirty, self._dirty = self._dirty, set()
+        if not events and not dirty:
+            return
+        users = [(uid, u.name, u.streak, u.best_streak, u.tests, u.best_score)
+                 for uid, u in ((uid, self.users[uid]) for uid in dirty)]
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany("INSERT INTO answer_events VALUES (?, ?, ?, ?, ?, ?)", events)
+            self.conn.executemany(
+                "INSERT INTO stats_users VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (uid) DO UPDATE SET "
+                "name = excluded.name, streak = excluded.streak, best_streak = excluded.best_streak, "
+                "tests = excluded.tests, best_score = excluded.best_score",
+                users,
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            self._events = events + self._events
+            self._dirty |= dirty
+            raise
+
+    def compact(self, now: float = None) -> int:
+        """Свернуть события прошлых суток (UTC) в answer_daily; повторы после ошибки не нужны."""
+        if self.conn is None:
+            return 0
+        cutoff = _day_start(now or time.time()).timestamp()
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute(
+                "INSERT INTO answer_daily (day, uid, aid, questions, correct, latency_ms) "
+                "SELECT date(ts, 'unixepoch'), uid, aid, COUNT(*), SUM(correct), SUM(latency_ms) "
+                "FROM answer_events WHERE first = 1 AND ts < ? GROUP BY 1, 2, 3 "
+                "ON CONFLICT (day, uid, aid) DO UPDATE SET questions = questions + excluded.questions, "
+                "correct = correct + excluded.correct, latency_ms = latency_ms + excluded.latency_ms",
+                (cutoff,),
+            )
+            removed = self.conn.execute("DELETE FROM answer_events WHERE ts < ?", (cutoff,)).rowcount
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        if removed:
+            logger.info(f"Compacted {removed} answer events into daily summaries")
+        return removed
+
+    # --- ЖИЗНЕННЫЙ ЦИКЛ ---
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._compact_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Stats flush failed: {e!r}")
+
+    async def _compact_loop(self):
+        while True:
+            try:
+                self.flush()
+                self.compact()
+            except Exception as e:
+                logger.warning(f"Stats compaction failed: {e!r}")
+            await asyncio.sleep(self.compact_interval)
+
+
+def _day_start(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _week_start(ts: float) -> datetime:
+    day = _day_start(ts)
+    return day - timedelta(days=day.weekday())
+
+
+def _week(ts: float):
+    return datetime.fromtimestamp(ts, timezone.utc).isocalendar()[:2]
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Запрос точно не ушёл на сервер: повтор безопасен и для POST
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def backoff_delay(base: float, attempt: int) -> float:
+    """Экспоненциальная пауза перед повтором с джиттером до +50%."""
+    return base * 2 ** attempt * (1 + random.random() / 2)
+
+
+class Supabase:
+    """Один httpx-клиент на всё время жизни бота: пул соединений, таймауты и ретраи к PostgREST."""
+
+    def __init__(self, url: str, key: str, http2: bool = True, max_connections: int = 20,
+                 connect_timeout: float = 5.0, read_timeout: float = 10.0,
+                 retries: int = 3, backoff: float = 0.3, transport=None):
+        self.base_url = f"{url}/rest/v1"
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+        self.http2 = http2
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections,
+                                   keepalive_expiry=60)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.transport = transport
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            http2 = self.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("h2 is not installed, falling back to HTTP/1.1 for Supabase")
+                    http2 = False
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, headers=self.headers, http2=http2,
+                limits=self.limits, timeout=self.timeout, transport=self.transport,
+            )
+        return self._client
+
+    async def start(self):
+        return self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, table: str, **kwargs) -> httpx.Response:
+        """Запрос с ретраями. POST не идемпотентен: после обрыва или таймаута чтения
+        строки могли уже вставиться, поэтому его повторяем только при ошибке соединения."""
+        retryable = UNSENT_ERRORS if method == "POST" else httpx.TransportError
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                r = await self.client.request(method, f"/{table}", **kwargs)
+            except httpx.TransportError as e:
+                metrics.external_call("supabase", f"{method} {table}", time.perf_counter() - started, error=True)
+                if attempt == self.retries or not isinstance(e, retryable):
+                    raise
+                logger.warning(f"Supabase {method} {table} failed: {e!r}, retrying")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            metrics.external_call("supabase", f"{method} {table}", time.perf_counter() - started,
+                                  error=r.status_code >= 400)
+            if r.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return r
+            retry_after = r.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else self._delay(attempt)
+            logger.warning(f"Supabase {method} {table} -> {r.status_code}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        return r
+
+    def _delay(self, attempt: int) -> float:
+        return backoff_delay(self.backoff, attempt)
+
+    async def select(self, table: str, params: dict = None) -> list:
+        r = await self.request("GET", table, params=params)
+        return r.json() if r.status_code == 200 else []
+
+    async def insert(self, table: str, rows, on_conflict: str = None, prefer: str = "return=minimal") -> httpx.Response:
+        params = {"on_conflict": on_conflict} if on_conflict else None
+        if on_conflict:
+            prefer = f"resolution=merge-duplicates,{prefer}"
+        return await self.request("POST", table, json=rows, params=params, headers={"Prefer": prefer})
+
+    async def update(self, table: str, params: dict, data: dict, prefer: str = "return=representation") -> httpx.Response:
+        return await self.request("PATCH", table, json=data, params=params, headers={"Prefer": prefer})
+
+    async def delete(self, table: str, params: dict, prefer: str = "return=minimal") -> httpx.Response:
+        return await self.request("DELETE", table, params=params, headers={"Prefer": prefer})
+
+    async def count(self, table: str, params: dict = None):
+        """Число строк по фильтру через Content-Range, без выгрузки самих строк."""
+        r = await self.request("HEAD", table, params=params, headers={"Prefer": "count=exact"})
+        total = r.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None